@@ -0,0 +1,320 @@
+"""Online detection of anomalous daily fire counts and weather.
+
+The "Fire anomalies" and "Weather" sections compare this year against a
+confidence band by eye.  This module keeps, for every variable, block and day
+of year, the count, mean and sum of squared deviations of the observations
+seen so far, in three arrays of shape (variables, blocks, 366).  Each new
+daily value is scored by its z score against the baseline of its day of
+year, then folded into that baseline (Welford's update), so a daily refresh
+touches one cell per block and variable rather than recomputing the history.
+
+The state is saved as data/anomalies/state.npz, and the observations flagged
+so far as data/anomalies/flags.arrow:
+
+	python anomalies.py init
+	python anomalies.py update fires new_days.pkl [--alert]
+
+init builds the baseline from the years before climatology.CURRENT_YEAR and
+then scores the current year.  update scores and folds in the new rows of one
+dataset (rows on or before the last date seen for a block are ignored); with
+--alert, the exit status is 1 when any of them was flagged.
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+
+import cache
+import climatology
+import store
+
+
+# Variables tracked, by dataset.
+VARIABLES = {
+	'fires': ['fires'],
+	'weather': ['temp_celsius', 'precip_cm'],
+}
+
+ANOMALY_DIR = os.path.join(store.DATA_DIR, 'anomalies')
+
+STATE_PATH = os.path.join(ANOMALY_DIR, 'state.npz')
+
+FLAGS_PATH = os.path.join(ANOMALY_DIR, 'flags.arrow')
+
+# Observations more than this many standard deviations from the mean of
+# their day of year are flagged.
+THRESHOLD = 3.0
+
+# Days of year with fewer observations in the baseline are not scored.
+MIN_COUNT = 5
+
+# Floor on the standard deviation of each variable, so that one fire on a
+# day of year that never had any is not infinitely unlikely.
+MIN_STD = {'fires': 1.0, 'temp_celsius': 0.5, 'precip_cm': 0.1}
+
+DAYS = 366
+
+# Last date of a block that has not been observed.
+NEVER = np.iinfo(np.int64).min
+
+FLAG_COLUMNS = ['block', 'date', 'variable', 'value', 'mean', 'std', 'z']
+
+FLAG_DTYPES = {
+	'block': object, 'date': object, 'variable': object,
+	'value': float, 'mean': float, 'std': float, 'z': float,
+}
+
+
+def _days(dates):
+	# Days since 1970-01-01 of YYYY-MM-DD dates, parsed once per distinct date.
+	dates = pd.Categorical(dates)
+	days = np.asarray(dates.categories.astype(str), dtype='datetime64[D]').astype(np.int64)
+	return days[dates.codes]
+
+
+class Baseline(object):
+	"""Running statistics of each variable by block and day of year."""
+
+	def __init__(self, variables=None, blocks=()):
+		self.variables = list(variables or [v for vs in VARIABLES.values() for v in vs])
+		self.blocks = pd.Index([], dtype=object)
+		shape = (len(self.variables), 0, DAYS)
+		self.count = np.zeros(shape, dtype=np.int32)
+		self.mean = np.zeros(shape)
+		self.m2 = np.zeros(shape)
+		# Last date folded in, by variable and block, in days since 1970.
+		self.last = np.full(shape[:2], NEVER, dtype=np.int64)
+		self._add(blocks)
+
+	def _add(self, blocks):
+
+		new = pd.Index(pd.unique(np.asarray(blocks, dtype=object))).difference(self.blocks, sort=False)
+		if not len(new):
+			return
+
+		self.blocks = self.blocks.append(new)
+		grow = (len(self.variables), len(new), DAYS)
+		self.count = np.concatenate([self.count, np.zeros(grow, dtype=np.int32)], axis=1)
+		self.mean = np.concatenate([self.mean, np.zeros(grow)], axis=1)
+		self.m2 = np.concatenate([self.m2, np.zeros(grow)], axis=1)
+		self.last = np.concatenate([self.last, np.full(grow[:2], NEVER, dtype=np.int64)], axis=1)
+
+	def _cells(self, df):
+		# Block and day-of-year positions of each row, adding new blocks.
+		block = np.asarray(df['block'], dtype=object)
+		self._add(block)
+		return self.blocks.get_indexer(block), df['day_of_year'].to_numpy(dtype=np.int64) - 1
+
+	def score(self, df):
+		"""Mean, standard deviation and z score of each row, by variable.
+
+		Returns a dict of variable to (mean, std, z) arrays aligned with the
+		rows of `df`; z is NaN where the baseline is too short.
+		"""
+
+		rows, days = self._cells(df)
+		scores = {}
+		for i, v in enumerate(self.variables):
+			if v not in df:
+				continue
+			x = df[v].to_numpy(dtype=float)
+			n = self.count[i, rows, days]
+			mean = self.mean[i, rows, days]
+			with np.errstate(divide='ignore', invalid='ignore'):
+				std = np.sqrt(self.m2[i, rows, days] / (n - 1))
+			std = np.fmax(std, MIN_STD.get(v, 0))
+			with np.errstate(divide='ignore', invalid='ignore'):
+				z = (x - mean) / std
+			z[n < MIN_COUNT] = np.nan
+			scores[v] = (mean, std, z)
+		return scores
+
+	def _new(self, i, rows, dates, x):
+		# Rows with a value for the variable, after the last date seen.
+		return np.isfinite(x) & (dates > self.last[i, rows])
+
+	def update(self, df):
+		"""Fold the rows of `df` newer than those seen into the baseline.
+
+		Several observations of a cell are merged at once, with the pairwise
+		form of Welford's update, so the history can be folded in as a batch.
+		"""
+
+		rows, days = self._cells(df)
+		dates = _days(df['date'])
+
+		for i, v in enumerate(self.variables):
+			if v not in df:
+				continue
+			x = df[v].to_numpy(dtype=float)
+			new = self._new(i, rows, dates, x)
+			if not new.any():
+				continue
+
+			cell, inverse = np.unique(rows[new] * DAYS + days[new], return_inverse=True)
+			n_b = np.bincount(inverse).astype(float)
+			mean_b = np.bincount(inverse, x[new]) / n_b
+			m2_b = np.bincount(inverse, (x[new] - mean_b[inverse]) ** 2)
+
+			count, mean, m2 = [a[i].reshape(-1) for a in (self.count, self.mean, self.m2)]
+			n_a, mean_a = count[cell].astype(float), mean[cell]
+			n = n_a + n_b
+			delta = mean_b - mean_a
+			mean[cell] = mean_a + delta * n_b / n
+			m2[cell] += m2_b + delta ** 2 * n_a * n_b / n
+			count[cell] = n
+
+			np.maximum.at(self.last[i], rows[new], dates[new])
+
+	def observe(self, df, threshold=THRESHOLD):
+		"""Score the new rows of `df`, fold them in, and return those flagged.
+
+		Rows are taken a year at a time, so each is scored against the
+		baseline of the years before it.
+		"""
+
+		flags = []
+		for _, rows in df.groupby(df['year'].to_numpy(), sort=True):
+			positions, _ = self._cells(rows)
+			dates = _days(rows['date'])
+			for v, (mean, std, z) in self.score(rows).items():
+				x = rows[v].to_numpy(dtype=float)
+				flagged = self._new(self.variables.index(v), positions, dates, x) & (np.abs(z) > threshold)
+				if flagged.any():
+					flags.append(pd.DataFrame({
+						'block': np.asarray(rows['block'], dtype=object)[flagged],
+						'date': np.asarray(rows['date'].astype(str), dtype=object)[flagged],
+						'variable': v,
+						'value': x[flagged],
+						'mean': mean[flagged],
+						'std': std[flagged],
+						'z': z[flagged],
+					}))
+			self.update(rows)
+
+		return _flag_frame(flags)
+
+	def save(self, path=STATE_PATH):
+
+		os.makedirs(os.path.dirname(path), exist_ok=True)
+		tmp = '%s.%d.tmp' % (path, os.getpid())
+		with open(tmp, 'wb') as f:
+			np.savez(
+				f, variables=np.array(self.variables, dtype=str),
+				blocks=np.array(self.blocks, dtype=str),
+				count=self.count, mean=self.mean, m2=self.m2, last=self.last,
+			)
+		os.replace(tmp, path)
+
+	@classmethod
+	def load(cls, path=STATE_PATH):
+
+		with np.load(path) as state:
+			baseline = cls(list(state['variables']))
+			baseline.blocks = pd.Index(state['blocks'].astype(object))
+			baseline.count = state['count']
+			baseline.mean = state['mean']
+			baseline.m2 = state['m2']
+			baseline.last = state['last']
+		return baseline
+
+
+def _flag_frame(frames):
+	# Flags of several frames, typed as such even when there are none.
+	empty = pd.DataFrame({c: pd.Series([], dtype=FLAG_DTYPES[c]) for c in FLAG_COLUMNS})
+	return pd.concat([empty] + list(frames), ignore_index=True).astype(FLAG_DTYPES)
+
+
+def init(before=climatology.CURRENT_YEAR):
+	"""Baseline of the years before `before`, and the flags of the rest."""
+
+	baseline = Baseline()
+	flags = []
+	for name in VARIABLES:
+		df = store.read(name)
+		recent = df['year'].to_numpy() >= before
+		baseline.update(df[~recent])
+		flags.append(baseline.observe(df[recent]))
+	return baseline, _flag_frame(flags)
+
+
+def save_flags(flags, path=FLAGS_PATH):
+	"""Add `flags` to the stored ones."""
+
+	if os.path.exists(path):
+		flags = _flag_frame([pd.read_feather(path), flags])
+	else:
+		flags = _flag_frame([flags])
+	flags = flags.drop_duplicates(['block', 'date', 'variable'], keep='last')
+	flags = flags.sort_values(['block', 'date', 'variable']).reset_index(drop=True)
+
+	os.makedirs(os.path.dirname(path), exist_ok=True)
+	tmp = '%s.%d.tmp' % (path, os.getpid())
+	flags.to_feather(tmp)
+	os.replace(tmp, path)
+
+
+def update(name, df):
+	"""Score and fold in new rows of dataset `name`.  Returns those flagged."""
+
+	baseline = Baseline.load()
+	flags = baseline.observe(df)
+	baseline.save()
+	save_flags(flags)
+	return flags
+
+
+@cache.memoize(maxsize=4, datasets=list(VARIABLES))
+def _flags(stamp):
+	if stamp is None:
+		return init()[1]
+	return _flag_frame([pd.read_feather(FLAGS_PATH)])
+
+
+def flagged(block):
+	"""Flagged observations of a block, from the stored flags if any."""
+
+	# Without stored flags, the current year is scored from the datasets.
+	if os.path.exists(FLAGS_PATH):
+		stamp = os.stat(FLAGS_PATH).st_mtime_ns
+	else:
+		stamp = None
+	df = _flags(stamp)
+	return df[df['block'] == block]
+
+
+if __name__ == '__main__':
+
+	import argparse
+	import sys
+
+	parser = argparse.ArgumentParser(description='Detect anomalous daily observations.')
+	parser.add_argument('command', choices=['init', 'update'])
+	parser.add_argument('name', nargs='?', choices=list(VARIABLES),
+		help='dataset of the new rows, for update')
+	parser.add_argument('path', nargs='?', help='pickle or CSV of new rows, for update')
+	parser.add_argument('--alert', action='store_true',
+		help='exit with status 1 if any row is flagged')
+	args = parser.parse_args()
+
+	if args.command == 'init':
+		baseline, flags = init()
+		baseline.save()
+		if os.path.exists(FLAGS_PATH):
+			os.remove(FLAGS_PATH)
+		save_flags(flags)
+
+	else:
+		if args.path.endswith('.csv'):
+			df = pd.read_csv(args.path, dtype={'date': str})
+		else:
+			df = pd.read_pickle(args.path)
+		flags = update(args.name, store.prepare(args.name, df, validate=True))
+
+	with pd.option_context('display.width', 120, 'display.max_rows', 200):
+		print(flags.to_string(index=False) if len(flags) else 'No anomalies.')
+	print('%d flagged' % len(flags))
+
+	if args.alert and len(flags):
+		sys.exit(1)
@@ -1,15 +1,30 @@
 import pandas as pd
 import numpy as np
 import altair as alt
-import streamlit as st
-import geopandas as gpd
-import matplotlib.pyplot as plt
-import datetime
-from statsmodels.tsa.stattools import adfuller
 import pydeck as pdk
-import plotly.graph_objects as go
-import plotly.express as px
+import streamlit as st
+
+import anomalies
+import climatology
+import downsample
+import instrument
+import maps
+import portfolio
+import ranking
+import reports
+import similarity
+import smoothing
+import store
+import timeseries
+import trends
+
 
+# Merges the segments appended to the daily series, in one thread per process.
+timeseries.start_compaction(timeseries.SERIES)
+
+sections = instrument.start()
+
+sections.enter("Ranking")
 
 st.header("Prioritizing concessions based on Earth observation")
 
@@ -22,32 +37,6 @@ optimization.  If you had USD$1M, which concessions would you conserve?_
 
 """)
 
-@st.cache(persist=True)
-def load_data(plot=True):
-
-	properties = pd.read_pickle('data/properties.pkl')
-	vi = pd.read_pickle('data/vi.pkl')
-	defor = pd.read_pickle('data/defor.pkl')
-	water = pd.read_pickle('data/waterclass.pkl')
-	evapo = pd.read_pickle('data/evapotranspiration.pkl')
-	pop = pd.read_pickle('data/population.pkl')
-	soil = pd.read_pickle('data/soil.pkl')
-	carbon = pd.read_pickle('data/carbon.pkl')
-	forestcarbon = pd.read_pickle('data/forestcarbon.pkl')
-	weather = pd.read_pickle('data/weather.pkl')
-	pop_rate = pd.read_pickle('data/pop.pkl')
-	buildings = pd.read_pickle('data/buildings.pkl')
-	summary = pd.read_pickle('data/summary.pkl')
-
-	fires = pd.read_pickle('data/fires.pkl')
-	fires.columns = ['fires', 'date', 'block']
-
-	return properties, vi, defor, water, evapo, fires, pop, soil, carbon, forestcarbon, weather, pop_rate, buildings, summary
-
-
-properties, vi, defor, water, evapo, fires, pop, soil, carbon, forestcarbon, weather, pop_rate, buildings, summary = load_data()
-
-
 st.markdown("""
 
 	This roughcut web application is intended to illustrate both the baseline and
@@ -89,25 +78,9 @@ connectivity_weight = st.slider(
 	0, 100, 50
 )
 
-denom = human_weight + bio_weight + connectivity_weight
+weights = ranking.weight_vector(human_weight, bio_weight, connectivity_weight)
 
-x = summary.copy()
-
-x["wt"] = x["bio"]/max(x["bio"]) * (bio_weight / denom) \
-		+ x["defor"]/max(x["defor"]) * (human_weight / denom / 2) \
-		+ x["pop"]/max(x["pop"]) * (human_weight / denom / 2) \
-		+ x["forest"]/max(x["forest"]) * (connectivity_weight / denom)
-
-if weighting_scheme == "Absolute":
-	
-	x["wt"] = x["wt"] / max(x["wt"])
-	df = x[["block", "wt"]]
-
-else:
-
-	x["wt"] = 10000 * x["wt"] / x["area"]
-	x["wt"] = x["wt"] / max(x["wt"])
-	df = x[["block", "wt"]]
+df = ranking.load().rank(weights, weighting_scheme)
 
 bars = alt.Chart(df).mark_bar(size=20).encode(
     x=alt.X(
@@ -140,6 +113,71 @@ bars = alt.Chart(df).mark_bar(size=20).encode(
 
 st.altair_chart(bars, use_container_width=True)
 
+sections.enter("Map")
+
+# Drawn from the least detailed boundaries that resolve the initial view.
+map_view = maps.view(maps.levels()[maps.LEVELS[0]])
+
+if map_view is None:
+	st.markdown("No block boundaries are available to map.")
+else:
+	map_longitude, map_latitude, map_zoom = map_view
+	map_level, _ = maps.level(map_zoom)
+	concessions = maps.colored(
+		maps.levels()[map_level], dict(zip(df['block'], df['wt']))
+	)
+
+	st.pydeck_chart(pdk.Deck(
+		layers=[
+			pdk.Layer(
+				'GeoJsonLayer',
+				concessions,
+				get_fill_color='properties.color',
+				get_line_color=[255, 255, 255],
+				line_width_min_pixels=1,
+				pickable=True
+			)
+		],
+		initial_view_state=pdk.ViewState(
+			longitude=map_longitude,
+			latitude=map_latitude,
+			zoom=map_zoom
+		),
+		tooltip={'text': '{block}: {weight}'}
+	), use_container_width=True)
+
+sections.enter("Portfolio")
+
+st.markdown("""
+
+	Given a budget, the same weights select a portfolio: the set of concessions
+	with the highest total weight whose fees fit within the budget.
+
+""")
+
+budget = st.slider(
+	'Budget (USD)',
+	0, 1000000, 100000,
+	step=10000
+)
+
+portfolio_fees = store.load('properties').set_index("HUNT_BLOCK")["TOTALFEES"]
+portfolio_fees = portfolio_fees.reindex(df["block"]).fillna(0).to_numpy()
+
+selected = portfolio.solve(df["wt"].to_numpy(), portfolio_fees, budget)
+
+st.markdown("""
+
+	With **$%s**, the selected concessions are **%s**, for a total of **$%s** in
+	fees.
+
+""" % (
+		"{:,d}".format(budget),
+		", ".join(df["block"][selected]) or "none",
+		"{:,d}".format(int(portfolio_fees[selected].sum()))
+	)
+)
+
 st.markdown(""" 
 
 -----
@@ -151,26 +189,43 @@ following sections.
 """)
 
 
-block_names = list(properties["HUNT_BLOCK"])
+sections.enter("Summary")
+
+block_names = list(store.load('properties')["HUNT_BLOCK"])
 
 block_name = st.selectbox(
 	'Select the Hunting Block',
-	block_names
+	block_names,
+	key='block'
+)
+
+full_resolution = st.checkbox(
+	'Show every daily observation in the time series (scroll to zoom)',
+	False
 )
 
-area = int(properties.loc[properties["HUNT_BLOCK"] == block_name, "AREA"])
-fees = int(properties.loc[properties["HUNT_BLOCK"] == block_name, "TOTALFEES"])
-outfitter = list(properties.loc[properties["HUNT_BLOCK"] == block_name, "OUTFITTER2"])[0]
+page = reports.Page(block_name, defaults=not full_resolution)
+
+if page.cached():
+	sections.enter("Cached report")
+	page.serve()
+	sections.finish()
+	st.stop()
+
+block_properties = store.get_block('properties', block_name)
+
+area = int(block_properties["AREA"].iloc[0])
+fees = int(block_properties["TOTALFEES"].iloc[0])
+outfitter = block_properties["OUTFITTER2"].iloc[0]
 
 animal_names = ["BUFFALO", "IMPALA", "LEOPARD", "LION", "PUKU"]
-animals = properties.loc[properties["HUNT_BLOCK"] == block_name, animal_names].to_dict()
+animals = block_properties[animal_names].to_dict()
+
+building_count = int(store.get_block('buildings', block_name)["buildings"].iloc[0])
 
-building_count = int(buildings.loc[buildings["block"] == block_name, "buildings"])
+block_metrics = store.get_block('metrics', block_name).iloc[0]
 
-ppop_rate = pop_rate.copy()
-ppop_rate[['pop_rate']]=ppop_rate.groupby('block')[["population", "block"]].pct_change()
-pop_rate_num = ppop_rate.loc[pop_rate["block"] == block_name, "pop_rate"]
-pop_rate_num = np.round(100*np.mean(pop_rate_num), 2)
+pop_rate_num = np.round(100*block_metrics["pop_rate"], 2)
 
 def animal_string(animals):
 
@@ -190,9 +245,9 @@ def animal_string(animals):
 		return "multiple (%s) documented animals" % ", ".join(full_l)
 
 
-popest = int(pop.loc[pop['block'] == block_name, 'population2018'])
+popest = int(store.get_block('population', block_name)['population2018'].iloc[0])
 
-st.markdown("""
+page.markdown("""
 
 	------
 
@@ -220,15 +275,68 @@ st.markdown("""
 	)
 )
 
-carbon_df = carbon[carbon["block"] == block_name]
+sections.enter("Similar areas")
 
-carbon_df["tC"] = carbon_df["carbon"] * 9 * carbon_df["frequency"]
+similar = similarity.similar(block_name, 5)
 
-mtC = np.round(sum(carbon_df["tC"])/1000000, 2)
+page.markdown("""
 
-avgtC_per_hectare = sum(carbon_df["tC"])/sum(carbon_df["frequency"])
+	The concessions most similar to %s, by their summary criteria, carbon and
+	soil carbon distributions and seasonal fire and vegetation profiles (a
+	smaller distance is more similar), are %s.
 
-st.markdown("""
+""" % (
+		block_name,
+		", ".join(
+			"%s (%.2f)" % (area, distance)
+			for area, distance in zip(similar['area'], similar['distance'])
+		)
+	)
+)
+
+sections.enter("Trends")
+
+TREND_LABELS = {
+	'fires': 'Fires (count)',
+	'NDVI': 'NDVI',
+	'EVI': 'EVI',
+	'evapotranspiration': 'Evapotranspiration (mm)',
+	'temp_celsius': 'Temperature (C)',
+	'precip_cm': 'Precipitation (cm)',
+}
+
+def trend_row(row):
+	if np.isnan(row.mk_p):
+		return "| %s | %s-%s | too few observations | | | |" % (TREND_LABELS[row.variable], row.start, row.end)
+	return "| %s | %s-%s | %s | %.3g | %.2g | %s |" % (
+		TREND_LABELS[row.variable], row.start, row.end,
+		row.trend if row.trend != 'none' else 'no significant trend',
+		row.sen_slope, row.mk_p,
+		'yes' if row.stationary else 'no'
+	)
+
+page.markdown("""
+
+	Monthly means of each daily series, tested for a monotonic trend across
+	years within each calendar month (seasonal Mann-Kendall test, 5 percent
+	level), with the median change per year (Sen's slope).  Anomalies from the
+	seasonal cycle are stationary when an augmented Dickey-Fuller test rejects
+	a unit root at the 5 percent level.
+
+	| Series | Years | Trend | Change per year | p-value | Stationary anomalies |
+	| --- | --- | --- | --- | --- | --- |
+	%s
+
+""" % "\n\t".join(trend_row(row) for row in trends.block_trends(block_name).itertuples())
+)
+
+sections.enter("Carbon")
+
+carbon_df = store.get_block('carbon', block_name)
+
+mtC = np.round(block_metrics["mtC"], 2)
+
+page.markdown("""
 
 	----
 
@@ -249,12 +357,12 @@ st.markdown("""
 """ % (
 		block_name,
 		mtC,
-		np.round(avgtC_per_hectare/9, 2)
+		np.round(block_metrics["tC_per_ha"], 2)
 	)
 )
 
 
-c = alt.Chart(carbon_df).mark_bar(
+c = alt.Chart(carbon_df[["carbon", "frequency"]]).mark_bar(
 		color="#A9BEBE",
 		size=2.5
 	).encode(
@@ -270,12 +378,14 @@ c = alt.Chart(carbon_df).mark_bar(
 	    )
 )
 
-st.altair_chart(c, use_container_width=True)
+page.altair_chart(c)
 
 
-soil_df = soil[soil["block"] == block_name]
+sections.enter("Soil")
 
-st.markdown(""" 
+soil_df = store.get_block('soil', block_name)
+
+page.markdown(""" 
 
 	### Soil organic carbon density
 
@@ -287,7 +397,7 @@ st.markdown("""
 """ % block_name)
 
 
-c = alt.Chart(soil_df).mark_area(interpolate="basis").encode(
+c = alt.Chart(soil_df[["carbon_g_per_kg", "frequency", "depth"]]).mark_area(interpolate="basis").encode(
     alt.X(
     	'carbon_g_per_kg',
     	title="Carbon density (g/kg)",
@@ -317,21 +427,19 @@ c = alt.Chart(soil_df).mark_area(interpolate="basis").encode(
 ).configure_view(strokeWidth=0)
 
 
-st.altair_chart(c, use_container_width=True)
+page.altair_chart(c)
 
 
-forestcarbon_df = forestcarbon[
-	(forestcarbon["block"] == block_name) & \
-	(forestcarbon["carbon"] > 0)
-]
+sections.enter("Forest carbon")
 
-forestcarbon_df["tC"] = forestcarbon_df["carbon"] * 9 * forestcarbon_df["frequency"]
+forestcarbon_df = store.get_block('forestcarbon', block_name)
+forestcarbon_df = forestcarbon_df[forestcarbon_df["carbon"] > 0]
 
-forest_mtC = np.round(sum(forestcarbon_df["tC"])/1000000, 2)
+forest_mtC = np.round(block_metrics["forest_mtC"], 2)
 
-forest_carbon_percent = np.round(100*forest_mtC/mtC, 2)
+forest_carbon_percent = np.round(block_metrics["forest_carbon_percent"], 2)
 
-st.markdown("""
+page.markdown("""
 
 	### Forest carbon
 
@@ -360,7 +468,7 @@ st.markdown("""
 )
 
 
-c = alt.Chart(forestcarbon_df).mark_bar(
+c = alt.Chart(forestcarbon_df[["carbon", "frequency"]]).mark_bar(
 		color="#A9BEBE",
 		size=2.5
 	).encode(
@@ -376,10 +484,12 @@ c = alt.Chart(forestcarbon_df).mark_bar(
 	    )
 )
 
-st.altair_chart(c, use_container_width=True)
+page.altair_chart(c)
 
 
-st.markdown("""
+sections.enter("Fires")
+
+page.markdown("""
 
 	----
 
@@ -394,7 +504,9 @@ st.markdown("""
 
 """)
 
-fires_df = fires[fires["block"]==block_name]
+fires_df = downsample.chart_data(
+	'fires', block_name, 'fires', 'minmax', full_resolution
+)
 
 c = alt.Chart(fires_df).mark_bar(
 		color="#e45756",
@@ -404,9 +516,14 @@ c = alt.Chart(fires_df).mark_bar(
 	    y='fires'
 )
 
-st.altair_chart(c, use_container_width=True)
+if full_resolution:
+	c = c.interactive(bind_y=False)
 
-st.markdown("""
+page.altair_chart(c)
+
+sections.enter("Fire anomalies")
+
+page.markdown("""
 
 	### Fire anomalies
 
@@ -420,22 +537,25 @@ st.markdown("""
 
 """)
 
-fires_df['year'] = pd.DatetimeIndex(fires_df['date']).year
-fires_df['day_of_year'] = pd.DatetimeIndex(fires_df['date']).dayofyear
-fires_df_early = fires_df[fires_df["year"] < 2020]
-fires_df_late = fires_df[fires_df["year"] == 2020]
+climate_df = store.get_block('climatology', block_name)
 
-fires_ci = alt.Chart(fires_df_early).mark_errorband(extent='ci').encode(
+fires_ci = alt.Chart(
+	climate_df[["day_of_year", "fires_lower", "fires_upper"]]
+).mark_errorband().encode(
 	    x='day_of_year',
-	    y='fires'
+	    y=alt.Y('fires_lower:Q', title='fires'),
+	    y2='fires_upper:Q'
 )
 
 
-fires_smooth = alt.Chart(fires_df_late).mark_line(
+fires_df_late = smoothing.smoothed(
+	'fires', block_name, 'fires', 10, year=climatology.CURRENT_YEAR
+)
+
+fires_smooth = alt.Chart(
+	fires_df_late[["day_of_year", "rolling_mean"]]
+).mark_line(
 	color='#e45756'
-).transform_window(
-	rolling_mean='mean(fires)',
-	frame=[-10, 10]
 ).encode(
 	x=alt.X(
 		'day_of_year',
@@ -448,17 +568,48 @@ fires_smooth = alt.Chart(fires_df_late).mark_line(
 	)
 )
 
-st.altair_chart(fires_ci + fires_smooth, use_container_width=True)
+page.altair_chart(fires_ci + fires_smooth)
 
+block_anomalies = anomalies.flagged(block_name)
+block_anomalies = block_anomalies[
+	block_anomalies['date'] >= '%d-01-01' % climatology.CURRENT_YEAR
+]
 
+def anomaly_text(variable, description, units):
+	flags = block_anomalies[block_anomalies['variable'] == variable]
+	if not len(flags):
+		return """
 
+	No day of %s is flagged as having an anomalous %s.
+
+""" % (climatology.CURRENT_YEAR, description)
+
+	rows = "\n\t".join(
+		"| %s | %.4g | %.4g | %.1f |" % (row.date, row.value, row.mean, row.z)
+		for row in flags.itertuples()
+	)
+	return """
+
+	Days of %s flagged as having an anomalous %s, more than %g standard
+	deviations from the mean of the same day of year in the years before:
+
+	| Date | %s | Baseline mean | z score |
+	| --- | --- | --- | --- |
+	%s
+
+""" % (climatology.CURRENT_YEAR, description, anomalies.THRESHOLD, units, rows)
+
+page.markdown(anomaly_text('fires', 'fire count', 'Fires'))
 
-defor_df = defor[defor["block"]==block_name]
-total_defor = sum(defor["hectares"]) 
-total_defor_perc = int(10000 * total_defor/(area * 100))
-total_defor_perc = total_defor_perc/100
 
-st.markdown("""
+
+
+sections.enter("Deforestation")
+
+defor_df = store.get_block('defor', block_name)
+total_defor_perc = int(100 * block_metrics["defor_percent"])/100
+
+page.markdown("""
 
 	----
 
@@ -472,20 +623,22 @@ st.markdown("""
 
 """ %(block_name, total_defor_perc) )
 
-c = alt.Chart(defor_df).mark_bar(
+c = alt.Chart(defor_df[["year", "hectares"]]).mark_bar(
 		color="#e45756"
 	).encode(
 	    x='year:O',
 	    y='hectares'
 )
 
-st.altair_chart(c, use_container_width=True)
+page.altair_chart(c)
 
-water_df = water[water["block"]==block_name]
-total_water_area = np.round(sum(water_df["area_km2"]), 2)
-percent_water_area = np.round(100*total_water_area/area, 2)
+sections.enter("Surface water")
 
-st.markdown("""
+water_df = store.get_block('waterclass', block_name)
+total_water_area = np.round(block_metrics["water_km2"], 2)
+percent_water_area = np.round(block_metrics["water_percent"], 2)
+
+page.markdown("""
 
 	----
 
@@ -513,6 +666,10 @@ st.markdown("""
 	)
 )
 
+# plotly is only needed for this chart, so it is imported here rather than
+# on every start-up.  See profile_imports.py.
+import plotly.graph_objects as go
+
 labels = water_df["water_label"]
 values = water_df["area_km2"]
 
@@ -550,10 +707,12 @@ fig.update_layout(legend=dict(
     x=1
 ))
 
-st.plotly_chart(fig, use_container_width=True)
+page.plotly_chart(fig)
 
 
-st.markdown("""
+sections.enter("Vegetation")
+
+page.markdown("""
 
 	-------
 
@@ -569,12 +728,13 @@ st.markdown("""
 """)
 
 
-vegetation_index_name = st.selectbox(
+vegetation_index_name = page.selectbox(
 	'Vegetation Index',
 	[
 		"Normalized Difference Vegetation Index (NDVI)",
 		"Enhanced Vegetation Index (EVI)"
-	]
+	],
+	key='vegetation_index'
 )
 
 if vegetation_index_name == "Normalized Difference Vegetation Index (NDVI)":
@@ -582,7 +742,9 @@ if vegetation_index_name == "Normalized Difference Vegetation Index (NDVI)":
 else:
 	vi_name = "EVI"
 
-vi_df = vi[vi["block"]==block_name]
+vi_df = downsample.chart_data(
+	'vi', block_name, vi_name, 'lttb', full_resolution
+)
 
 nfdrs_data = alt.Chart(vi_df).mark_line(
 	color="#A9BEBE", 
@@ -592,12 +754,18 @@ nfdrs_data = alt.Chart(vi_df).mark_line(
 	y=vi_name
 )
 
-st.altair_chart(nfdrs_data, use_container_width=True)
+if full_resolution:
+	nfdrs_data = nfdrs_data.interactive(bind_y=False)
 
-evapo_df = evapo[evapo["block"]==block_name]
-evapo_df.columns = ["evapotranspiration", "date", "block"]
+page.altair_chart(nfdrs_data)
 
-st.markdown("""
+sections.enter("Evapotranspiration")
+
+evapo_df = downsample.chart_data(
+	'evapotranspiration', block_name, 'evapotranspiration', 'minmax', full_resolution
+)
+
+page.markdown("""
 
 	Evapotranspiration is the sum of evaporation from the land surface plus
 transpiration from plants. Like the vegetation indices, it is a useful
@@ -609,9 +777,10 @@ years of continued observations over Africa.  The data are collected daily at
 
 """)
 
-evapo_window = st.slider(
+evapo_window = page.slider(
 	'Symmetric moving average window (days on either side) to visualize long-term trends',
-	10, 200, 50
+	10, 200, 50,
+	key='evapo_window'
 )
 
 evapo_raw = alt.Chart(evapo_df).mark_circle(
@@ -622,11 +791,14 @@ evapo_raw = alt.Chart(evapo_df).mark_circle(
 	y='evapotranspiration'
 )
 
-evapo_smooth = alt.Chart(evapo_df).mark_line(
+evapo_df_smooth = downsample.smoothed(
+	'evapotranspiration', block_name, 'evapotranspiration', evapo_window, full_resolution
+)
+
+evapo_smooth = alt.Chart(
+	evapo_df_smooth[["date", "rolling_mean"]]
+).mark_line(
 	color='#e45756'
-).transform_window(
-	rolling_mean='mean(evapotranspiration)',
-	frame=[-evapo_window, evapo_window]
 ).encode(
 	x=alt.X(
 		'date:T',
@@ -642,10 +814,17 @@ evapo_smooth = alt.Chart(evapo_df).mark_line(
 	)
 )
 
-st.altair_chart(evapo_raw + evapo_smooth, use_container_width=True)
+evapo_chart = evapo_raw + evapo_smooth
 
+if full_resolution:
+	evapo_chart = evapo_chart.interactive(bind_y=False)
 
-st.markdown("""
+page.altair_chart(evapo_chart)
+
+
+sections.enter("Weather")
+
+page.markdown("""
 
 	-------
 
@@ -667,15 +846,10 @@ st.markdown("""
 
 """)
 
-weather_df = weather[weather["block"]==block_name]
-weather_df['year'] = pd.DatetimeIndex(weather_df['date']).year
-weather_df['day_of_year'] = pd.DatetimeIndex(weather_df['date']).dayofyear
-weather_df_early = weather_df[weather_df["year"] < 2020]
-weather_df_late = weather_df[weather_df["year"] == 2020]
-
-weather_variable = st.selectbox(
+weather_variable = page.selectbox(
 	'Weather variable',
-	['Daily mean temperature (C)', 'Daily precipitation (cm)']
+	['Daily mean temperature (C)', 'Daily precipitation (cm)'],
+	key='weather_variable'
 )
 
 var_dicts = {
@@ -683,21 +857,29 @@ var_dicts = {
 	'Daily precipitation (cm)': {'varname': 'precip_cm', 'units': 'Celsius'}
 }
 
-weather_ci = alt.Chart(weather_df_early).mark_errorband(extent='ci').encode(
+weather_varname = var_dicts[weather_variable]['varname']
+
+weather_ci = alt.Chart(
+	climate_df[["day_of_year", weather_varname + "_lower", weather_varname + "_upper"]]
+).mark_errorband().encode(
 	    x='day_of_year',
 	    y=alt.Y(
-	    	var_dicts[weather_variable]['varname'], 
+	    	'%s_lower:Q' % weather_varname,
 	    	scale=alt.Scale(zero=False),
 	    	title=""
-	    )
+	    ),
+	    y2='%s_upper:Q' % weather_varname
 )
 
 
-weather_smooth = alt.Chart(weather_df_late).mark_line(
+weather_df_late = smoothing.smoothed(
+	'weather', block_name, weather_varname, 2, year=climatology.CURRENT_YEAR
+)
+
+weather_smooth = alt.Chart(
+	weather_df_late[["day_of_year", "rolling_mean"]]
+).mark_line(
 	color='#e45756'
-).transform_window(
-	rolling_mean='mean(%s)' % var_dicts[weather_variable]['varname'],
-	frame=[-2, 2]
 ).encode(
 	x=alt.X(
 		'day_of_year',
@@ -712,9 +894,15 @@ weather_smooth = alt.Chart(weather_df_late).mark_line(
 	)
 )
 
-st.altair_chart(weather_ci + weather_smooth, use_container_width=True)
+page.altair_chart(weather_ci + weather_smooth)
 
-st.markdown("""
+page.markdown(anomaly_text(
+	weather_varname,
+	{'temp_celsius': 'mean temperature', 'precip_cm': 'precipitation'}[weather_varname],
+	weather_variable
+))
+
+page.markdown("""
 
 	### Climate
 
@@ -731,7 +919,69 @@ st.markdown("""
 
 """)
 
-st.markdown("""
+if 'projections' in store.datasets():
+	projections_df = store.get_block('projections', block_name)
+	projections_df = projections_df[projections_df['period'] == 'annual']
+else:
+	projections_df = pd.DataFrame()
+
+# Blocks outside the area of the ingested files have no projections.
+if len(projections_df):
+
+	PROJECTED_VARIABLES = {
+		'tasmax': 'Daily maximum temperature (C)',
+		'tasmin': 'Daily minimum temperature (C)',
+		'pr': 'Precipitation (mm/day)',
+	}
+
+	projected_variable = page.selectbox(
+		'Projected variable',
+		[
+			PROJECTED_VARIABLES.get(v, v)
+			for v in projections_df['variable'].astype(str).unique()
+		],
+		key='projected_variable'
+	)
+	projected_varname = {
+		label: v for v, label in PROJECTED_VARIABLES.items()
+	}.get(projected_variable, projected_variable)
+
+	# Mean and range across models, by scenario and year, with plain string
+	# labels so that the chart does not carry the categories.
+	ensemble = pd.DataFrame({
+		'scenario': np.asarray(projections_df['scenario'], dtype=object),
+		'variable': np.asarray(projections_df['variable'], dtype=object),
+		'year': projections_df['year'].to_numpy(),
+		'value': projections_df['value'].to_numpy(),
+	})
+	ensemble = ensemble[ensemble['variable'] == projected_varname].groupby(
+		['scenario', 'year']
+	)['value'].agg(['mean', 'min', 'max']).reset_index()
+
+	projection_range = alt.Chart(ensemble).mark_area(opacity=0.3).encode(
+		x=alt.X('year:O', axis=alt.Axis(title="", labelAngle=0, values=list(range(1950, 2101, 10)))),
+		y=alt.Y('min:Q', scale=alt.Scale(zero=False), title=projected_variable),
+		y2='max:Q',
+		color='scenario:N'
+	)
+
+	projection_mean = alt.Chart(ensemble).mark_line().encode(
+		x='year:O',
+		y='mean:Q',
+		color='scenario:N'
+	)
+
+	page.markdown("""
+
+	Annual mean of the area-weighted daily values over the concession, for
+	each emissions scenario: the line is the mean across models and the band
+	their range.
+
+""")
+
+	page.altair_chart(projection_range + projection_mean)
+
+page.markdown("""
 
 	----
 
@@ -805,3 +1055,6 @@ st.markdown("""
 # else:
 # 	st.altair_chart(nfdrs_smooth, use_container_width=True)
 
+page.save()
+
+sections.finish()
@@ -0,0 +1,175 @@
+"""Assemble data/summary.pkl, which drives the ranking chart.
+
+The summary is built by a small pipeline of stages, each declaring the
+datasets (data/<name>.pkl) or other stages it reads.  Stages whose inputs are
+ready run concurrently in a process pool, and a stage is skipped when the
+content hash of its inputs and code matches the previous run, so refreshing
+one dataset only redoes the stages that depend on it.
+
+	python assembly.py [--force] [--jobs N]
+
+Intermediate results and the manifest of hashes are kept in .assembly/.
+"""
+
+import argparse
+import collections
+import concurrent.futures
+import hashlib
+import inspect
+import json
+import os
+
+import pandas as pd
+
+import metrics
+import store
+
+
+BUILD_DIR = '.assembly'
+
+MANIFEST = os.path.join(BUILD_DIR, 'manifest.json')
+
+# A stage's key hashes the source of its function and of its `modules`, the
+# modules whose code the function calls into.
+Stage = collections.namedtuple('Stage', ['func', 'inputs', 'modules'], defaults=[()])
+
+
+def _area(properties):
+	final = properties[["HUNT_BLOCK", "AREA"]]
+	final.columns = ["block", "area"]
+	return final
+
+
+def _growth(pop):
+	return metrics.population_growth(pop).reset_index()
+
+
+def _deforestation(defor):
+	return defor.groupby('block', sort=False)["hectares"].sum().reset_index()
+
+
+def _summary(area, growth, population, deforestation, biodiversity, forest):
+
+	final = area.merge(growth, on="block")
+	final = final.merge(population, on="block")
+
+	final = final.merge(deforestation, on="block")
+	final["defor_rate"] = final["hectares"]/(final["area"] * 100)
+
+	final = final.merge(biodiversity, on="block")
+	final["bio_km"] = final["bio"] * final["area"]
+
+	final = final.merge(forest, on="block")
+	final["forest_km"] = final["forest"] * final["area"]
+
+	final.columns = ["block", "area", "pop_rate", "pop", "defor", "defor_rate", "bio_rate", "bio", "forest_rate", "forest"]
+	return final
+
+
+# Inputs that are not stages are datasets in data/.
+STAGES = collections.OrderedDict([
+	('area', Stage(_area, ['properties'])),
+	('growth', Stage(_growth, ['pop'], [metrics])),
+	('deforestation', Stage(_deforestation, ['defor'])),
+	('summary', Stage(_summary, ['area', 'growth', 'population', 'deforestation', 'biodiversity', 'forest'])),
+])
+
+
+def _output_path(stage):
+	return os.path.join(BUILD_DIR, '%s.pkl' % stage)
+
+
+def _file_hash(path):
+	digest = hashlib.sha256()
+	with open(path, 'rb') as f:
+		for chunk in iter(lambda: f.read(1 << 20), b''):
+			digest.update(chunk)
+	return digest.hexdigest()
+
+
+def _load(name):
+	if name in STAGES:
+		return pd.read_pickle(_output_path(name))
+	return pd.read_pickle(store.pickle_path(name))
+
+
+def _atomic_pickle(df, path):
+	tmp = path + '.tmp'
+	df.to_pickle(tmp)
+	os.replace(tmp, path)
+
+
+def run_stage(name):
+	"""Run one stage on its inputs and write its output.  Returns the name."""
+	stage = STAGES[name]
+	df = stage.func(*[_load(i) for i in stage.inputs])
+	_atomic_pickle(df, _output_path(name))
+	return name
+
+
+def _stage_key(name, hashes):
+	digest = hashlib.sha256(inspect.getsource(STAGES[name].func).encode())
+	for module in STAGES[name].modules:
+		digest.update(inspect.getsource(module).encode())
+	for i in STAGES[name].inputs:
+		digest.update(hashes[i].encode())
+	return digest.hexdigest()
+
+
+def build(force=False, jobs=None):
+	"""Run every stage whose inputs changed.  Returns the stages that ran."""
+
+	os.makedirs(BUILD_DIR, exist_ok=True)
+
+	manifest = {}
+	if os.path.exists(MANIFEST) and not force:
+		with open(MANIFEST) as f:
+			manifest = json.load(f)
+
+	# Datasets are hashed by content, stages by their code and inputs.
+	hashes = {}
+	for stage in STAGES.values():
+		for i in stage.inputs:
+			if i not in STAGES and i not in hashes:
+				hashes[i] = _file_hash(store.pickle_path(i))
+
+	pending = collections.OrderedDict()
+	for name in STAGES:
+		hashes[name] = _stage_key(name, hashes)
+		if manifest.get(name) != hashes[name] or not os.path.exists(_output_path(name)):
+			pending[name] = STAGES[name]
+
+	ran = []
+	with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as pool:
+		while pending:
+			ready = [
+				name for name, stage in pending.items()
+				if not any(i in pending for i in stage.inputs)
+			]
+			for name in pool.map(run_stage, ready):
+				manifest[name] = hashes[name]
+				del pending[name]
+				ran.append(name)
+
+	with open(MANIFEST + '.tmp', 'w') as f:
+		json.dump(manifest, f, indent=1, sort_keys=True)
+	os.replace(MANIFEST + '.tmp', MANIFEST)
+
+	if 'summary' in ran or not os.path.exists(store.pickle_path('summary')):
+		_atomic_pickle(_load('summary'), store.pickle_path('summary'))
+		store.convert('summary')
+
+	return ran
+
+
+if __name__ == '__main__':
+
+	parser = argparse.ArgumentParser(description='Assemble data/summary.pkl.')
+	parser.add_argument('--force', action='store_true',
+		help='rebuild every stage')
+	parser.add_argument('--jobs', type=int,
+		help='number of worker processes')
+	args = parser.parse_args()
+
+	ran = build(force=args.force, jobs=args.jobs)
+	print('ran: %s' % (', '.join(ran) or 'nothing, all stages up to date'))
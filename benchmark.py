@@ -0,0 +1,523 @@
+"""Benchmarks for data loading, per-block rendering and ranking.
+
+Runs app.py headlessly with streamlit's AppTest against the data in data/,
+and optionally against synthetic datasets with more blocks and 25-year daily
+series, and reports wall time, memory and the serialized size of what is sent to
+the browser:
+
+	python benchmark.py --synthetic 100 1000 --save baseline.json
+	python benchmark.py --compare baseline.json --tolerance 0.25
+
+Each scenario runs in a fresh process, and the peak resident size of that
+process is recorded.  With
+--trace-memory, the peak memory allocated by each step is traced as well;
+tracing slows pandas down several times, so timings taken with it are not
+comparable to those taken without.
+
+With --compare, every time, memory or payload metric that grew by more than
+the tolerance is reported and the exit status is 1.
+
+With --smoke, nothing is measured: ingest is checked to reject values that
+do not fit their column's type, and every block of the SMOKE_SCENARIOS is
+rendered headlessly, and the exit status is 1 if any check fails.
+
+	python benchmark.py --smoke [--synthetic N]
+"""
+
+import argparse
+import concurrent.futures
+import contextlib
+import json
+import multiprocessing
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+import anomalies
+import boundaries
+import cache
+import climatology
+import instrument
+import metrics
+import portfolio
+import ranking
+import reports
+import smoothing
+import store
+import timeseries
+import trends
+
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+APP = os.path.join(ROOT, 'app.py')
+
+# Datasets read by the app.
+DATASETS = [
+	'properties', 'summary', 'buildings', 'pop', 'population', 'carbon',
+	'soil', 'forestcarbon', 'fires', 'climatology', 'defor', 'waterclass',
+	'vi', 'evapotranspiration', 'weather', 'metrics',
+]
+
+
+# Set by --trace-memory.
+TRACE_MEMORY = False
+
+# Synthetic scenarios rendered by --smoke, as (name, years, projections).
+# None has boundaries; the short series are too short for any anomaly to be
+# flagged, and the projections leave out the first block.
+SMOKE_SCENARIOS = [
+	('short-series', 3, True),
+	('long-series', 10, False),
+]
+
+
+@contextlib.contextmanager
+def measure(results, key):
+	"""Record the wall time, and optionally the peak memory, of a block of code."""
+
+	if TRACE_MEMORY:
+		tracemalloc.start()
+	start = time.perf_counter()
+	try:
+		yield
+	finally:
+		results['%s.seconds' % key] = time.perf_counter() - start
+		if TRACE_MEMORY:
+			results['%s.peak_mb' % key] = tracemalloc.get_traced_memory()[1] / 2**20
+			tracemalloc.stop()
+
+
+def max_rss_mb():
+	# ru_maxrss is in kilobytes on Linux and in bytes on macOS.
+	rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+	return rss / 2**20 if sys.platform == 'darwin' else rss / 2**10
+
+
+def reset():
+	"""Forget every loaded dataset and derived result."""
+	store.registry.clear()
+	cache.clear()
+
+
+def payload_bytes(node):
+	"""Serialized size of the elements rendered under an AppTest node."""
+
+	proto = getattr(node, 'proto', None)
+	size = proto.ByteSize() if proto is not None else 0
+	for child in getattr(node, 'children', {}).values():
+		size += payload_bytes(child)
+	return size
+
+
+def _widget(at, kind, label):
+	return next(w for w in getattr(at, kind) if w.label == label)
+
+
+def bench_loading(results):
+
+	reset()
+	start = time.perf_counter()
+	for name in DATASETS:
+		with measure(results, 'load.%s' % name):
+			store.load(name)
+	results['load.total.seconds'] = time.perf_counter() - start
+	results['load.total.bytes'] = store.registry.nbytes
+
+
+def bench_components(results):
+
+	reset()
+	summary = store.load('summary')
+	blocks = list(store.load('properties')['HUNT_BLOCK'])
+
+	with measure(results, 'ranking.build'):
+		ranker = ranking.Ranking(summary)
+	grid = ranking.weight_vector(*np.meshgrid(*[np.arange(0, 101, 5)] * 3)).reshape(-1, 4)
+	with measure(results, 'ranking.grid'):
+		ranker.scores(grid, 'Relative')
+
+	values = ranker.scores(ranking.weight_vector(50, 50, 50))
+	fees = store.load('properties')['TOTALFEES'].to_numpy()
+	with measure(results, 'portfolio.solve'):
+		portfolio.solve(values, fees, 1000000)
+	with measure(results, 'portfolio.frontier'):
+		portfolio.frontier(values, fees, np.linspace(0, 1000000, 101))
+
+	store.load('evapotranspiration')
+	with measure(results, 'smoothing.window'):
+		smoothing._smoothed.func(
+			'evapotranspiration', store.version('evapotranspiration'), blocks[0], 'evapotranspiration', 50
+		)
+
+	with measure(results, 'climatology.build'):
+		climatology.build()
+
+	# The first call imports statsmodels.
+	trends.build(jobs=1, blocks=blocks[-1:])
+	with measure(results, 'trends.block'):
+		trends.build(jobs=1, blocks=blocks[:1])
+
+
+def bench_app(results, timeout=600):
+
+	from streamlit.testing.v1 import AppTest
+
+	def run(key, action=None):
+		with measure(results, 'app.%s' % key):
+			(action() if action else at).run()
+		if at.exception:
+			raise RuntimeError([e.value for e in at.exception])
+		results['app.%s.payload_bytes' % key] = payload_bytes(at.main)
+
+	reset()
+	at = AppTest.from_file(APP, default_timeout=timeout)
+
+	# Start from an empty report cache: a view of a block at the default
+	# widget values is served from the report written by its first view.
+	report_dir, reports.REPORT_DIR = reports.REPORT_DIR, tempfile.mkdtemp(prefix='reports-')
+
+	try:
+		# The first run is broken down by section of the page.
+		instrument.ENABLED = True
+		try:
+			run('first_run')
+		finally:
+			instrument.ENABLED = False
+		for section in instrument.metrics.last:
+			key = 'section.%s' % section['section'].lower().replace(' ', '_')
+			results['%s.seconds' % key] = section['seconds']
+			results['%s.payload_bytes' % key] = section['payload_bytes']
+
+		run('rerun')
+
+		blocks = _widget(at, 'selectbox', 'Select the Hunting Block')
+		run('block_switch', lambda: blocks.select(blocks.options[-1]))
+		run('block_return', lambda: blocks.select(blocks.options[0]))
+
+		slider = _widget(at, 'slider', 'Human pressure')
+		run('ranking_slider', lambda: slider.set_value(80))
+
+		window = _widget(
+			at, 'slider',
+			'Symmetric moving average window (days on either side) to visualize long-term trends'
+		)
+		run('smoothing_window', lambda: window.set_value(120))
+
+		weather = _widget(at, 'selectbox', 'Weather variable')
+		run('weather_variable', lambda: weather.select(weather.options[-1]))
+
+	finally:
+		shutil.rmtree(reports.REPORT_DIR)
+		reports.REPORT_DIR = report_dir
+
+
+def synthetic(root, blocks, years=25, current_year=climatology.CURRENT_YEAR, projections=False):
+	"""Write datasets with the schemas of data/ for `blocks` blocks.
+
+	With `projections`, also write projections for every block but the first.
+	"""
+
+	rng = np.random.default_rng(0)
+	names = np.array(['Block %04d' % i for i in range(blocks)], dtype=object)
+	area = rng.integers(500, 6000, blocks)
+
+	def daily(start, freq='D'):
+		dates = pd.date_range(start, '%d-08-21' % current_year, freq=freq)
+		return np.array(dates.strftime('%Y-%m-%d'), dtype=object)
+
+	def series(dates, **columns):
+		n = len(dates)
+		df = pd.DataFrame({
+			k: v(blocks * n) for k, v in columns.items()
+		})
+		df['date'] = np.tile(dates, blocks)
+		df['block'] = np.repeat(names, n)
+		return df
+
+	def histogram(column, values):
+		n = len(values)
+		return pd.DataFrame({
+			'frequency': rng.integers(0, 2000, blocks * n),
+			column: np.tile(values, blocks),
+			'block': np.repeat(names, n),
+		})
+
+	start = '%d-01-01' % (current_year - years + 1)
+
+	datasets = {
+		'properties': pd.DataFrame({
+			'AREA': area,
+			'BUFFALO': rng.integers(0, 10, blocks),
+			'IMPALA': rng.integers(0, 10, blocks),
+			'LEOPARD': rng.integers(0, 5, blocks),
+			'LION': rng.integers(0, 3, blocks),
+			'PUKU': rng.integers(0, 5, blocks),
+			'HUNT_BLOCK': names,
+			'OUTFITTER2': 'Outfitter',
+			'TOTALFEES': rng.integers(0, 20000, blocks) * 10,
+		}),
+		'summary': pd.DataFrame({
+			'block': names,
+			'area': area,
+			'pop_rate': rng.random(blocks) / 4,
+			'pop': rng.integers(100, 20000, blocks),
+			'defor': rng.integers(100, 6000, blocks),
+			'defor_rate': rng.random(blocks) / 100,
+			'bio_rate': rng.random(blocks) / 3,
+			'bio': rng.random(blocks) * 1500,
+			'forest_rate': rng.random(blocks),
+			'forest': rng.random(blocks) * 4000,
+		}),
+		'buildings': pd.DataFrame({'block': names, 'buildings': rng.integers(0, 20000, blocks)}),
+		'population': pd.DataFrame({'block': names, 'population2018': rng.integers(0, 20000, blocks)}),
+		'pop': series(
+			daily('2005-01-01', '5YS'),
+			population=lambda n: rng.random(n) * 20000
+		),
+		'carbon': histogram('carbon', np.linspace(0, 150, 170)),
+		'forestcarbon': histogram('carbon', np.linspace(0, 150, 150)),
+		'soil': pd.concat([
+			histogram('carbon_g_per_kg', np.arange(1, 11)).assign(depth=depth)
+			for depth in ['0cm', '10cm', '30cm', '60cm', '100cm', '200cm']
+		])[['frequency', 'carbon_g_per_kg', 'depth', 'block']],
+		'defor': pd.DataFrame({
+			'year': np.tile(np.arange(2001, 2020), blocks),
+			'hectares': rng.integers(0, 500, blocks * 19).astype(np.int32),
+			'block': np.repeat(names, 19),
+		}),
+		'waterclass': pd.DataFrame({
+			'area_km2': rng.random(blocks * 10) * 5,
+			'water_label': np.tile(['Permanent', 'New permanent', 'Lost permanent',
+				'Seasonal', 'New seasonal', 'Lost seasonal', 'Seasonal to permanent',
+				'Permanent to seasonal', 'Ephemeral permanent', 'Ephemeral seasonal'], blocks),
+			'block': np.repeat(names, 10),
+		}),
+		'vi': series(
+			daily(start, '16D'),
+			NDVI=lambda n: rng.random(n) * 8000,
+			EVI=lambda n: rng.random(n) * 5000
+		),
+		'evapotranspiration': series(daily(start), L1_RET_E=lambda n: rng.random(n) * 60),
+		'fires': series(daily(start), T21=lambda n: rng.poisson(0.5, n)),
+		'weather': series(
+			daily(start),
+			temp_celsius=lambda n: 15 + rng.random(n) * 15,
+			precip_cm=lambda n: rng.random(n) * 10
+		),
+	}
+
+	if projections:
+		rows = pd.MultiIndex.from_product([
+			names[1:], ['ACCESS1-0', 'CCSM4'], ['rcp45', 'rcp85'], ['tasmax', 'pr'],
+			np.arange(2006, 2101), ['annual', 'DJF', 'MAM', 'JJA', 'SON'],
+		], names=['block', 'model', 'scenario', 'variable', 'year', 'period']).to_frame(index=False)
+		datasets['projections'] = rows.assign(value=rng.random(len(rows)) * 40)
+
+	os.makedirs(os.path.join(root, store.DATA_DIR), exist_ok=True)
+	with chdir(root):
+		for name, df in datasets.items():
+			store.write(name, store.derive(name, df))
+		store.write('climatology', climatology.build())
+		store.write('metrics', metrics.build())
+
+
+@contextlib.contextmanager
+def chdir(path):
+	previous = os.getcwd()
+	os.chdir(path)
+	try:
+		yield
+	finally:
+		os.chdir(previous)
+
+
+def run_scenario(root, app=True):
+
+	results = {}
+	with chdir(root):
+		bench_loading(results)
+		bench_components(results)
+		if app:
+			bench_app(results)
+		reset()
+	results['process.max_rss_mb'] = max_rss_mb()
+	return results
+
+
+def _run_scenario(task):
+	# Runs in a fresh process.
+	root, app, trace_memory = task
+	global TRACE_MEMORY
+	TRACE_MEMORY = trace_memory
+	return run_scenario(root, app)
+
+
+def run_isolated(root, app=True):
+	"""run_scenario in a fresh process, so that its peak memory is its own.
+
+	ru_maxrss is the peak of the whole process: run in the same one, each
+	scenario would report the peak of the largest before it.
+	"""
+
+	context = multiprocessing.get_context('spawn')
+	with concurrent.futures.ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+		return pool.submit(_run_scenario, (root, app, TRACE_MEMORY)).result()
+
+
+def _check(at, scenario, step):
+	if at.exception:
+		raise RuntimeError('%s, %s: %s' % (scenario, step, [e.value for e in at.exception]))
+
+
+def check_ingest(root):
+	"""Raise RuntimeError unless a value out of its column's type is rejected
+	by store.convert and timeseries.append."""
+
+	df = pd.DataFrame({
+		'date': ['2020-01-01', '2020-01-02'],
+		'T21': [1, 40000],
+		'block': 'Block 0000',
+	})
+	os.makedirs(os.path.join(root, store.DATA_DIR), exist_ok=True)
+	with chdir(root):
+		df.to_pickle(store.pickle_path('fires'))
+		for step, ingest in [
+			('convert', lambda: store.convert('fires')),
+			('append', lambda: timeseries.append('fires', store.derive('fires', df))),
+		]:
+			try:
+				ingest()
+			except ValueError:
+				continue
+			raise RuntimeError('ingest, %s: fires=40000 was not rejected' % step)
+
+
+def smoke(blocks=20, timeout=600):
+	"""Render every block of each of SMOKE_SCENARIOS, raising on any error."""
+
+	from streamlit.testing.v1 import AppTest
+
+	root = tempfile.mkdtemp(prefix='smoke-')
+	try:
+		check_ingest(root)
+		print('ingest: out of range values rejected')
+	finally:
+		shutil.rmtree(root)
+
+	for scenario, years, projections in SMOKE_SCENARIOS:
+		root = tempfile.mkdtemp(prefix='smoke-')
+		try:
+			synthetic(root, blocks, years, projections=projections)
+			with chdir(root):
+				reset()
+				at = AppTest.from_file(APP, default_timeout=timeout)
+				at.run()
+				_check(at, scenario, 'first run')
+
+				# Every other block, then the first again, from its report.
+				options = _widget(at, 'selectbox', 'Select the Hunting Block').options
+				for block in options[1:] + options[:1]:
+					_widget(at, 'selectbox', 'Select the Hunting Block').select(block).run()
+					_check(at, scenario, block)
+
+				flagged = sum(len(anomalies.flagged(block)) for block in options)
+				projected = 0
+				if 'projections' in store.datasets():
+					projected = store.load('projections')['block'].nunique()
+				print('%s: %d blocks rendered, %d boundaries, %d anomalies, projections for %d blocks' % (
+					scenario, len(options), len(boundaries.load()), flagged, projected
+				))
+				reset()
+		finally:
+			shutil.rmtree(root)
+
+
+# Timings shorter than this are too noisy to flag.
+MIN_SECONDS = 0.05
+
+
+def compare(baseline, current, tolerance):
+	"""Metrics that regressed by more than `tolerance` (a fraction)."""
+
+	regressions = []
+	for scenario, metrics in baseline.items():
+		for key, before in metrics.items():
+			after = current.get(scenario, {}).get(key)
+			if after is None or before <= 0:
+				continue
+			if key.endswith('.seconds') and max(before, after) < MIN_SECONDS:
+				continue
+			if after > before * (1 + tolerance):
+				regressions.append((scenario, key, before, after))
+	return regressions
+
+
+def main():
+
+	parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+	parser.add_argument('--synthetic', type=int, nargs='*', default=[],
+		help='also benchmark synthetic datasets with these numbers of blocks')
+	parser.add_argument('--years', type=int, default=25,
+		help='length of the synthetic daily series')
+	parser.add_argument('--no-app', action='store_true',
+		help='skip the headless app runs')
+	parser.add_argument('--trace-memory', action='store_true',
+		help='trace the peak memory of each step (slow)')
+	parser.add_argument('--save', help='write the results to this JSON file')
+	parser.add_argument('--compare', help='baseline JSON file to compare against')
+	parser.add_argument('--tolerance', type=float, default=0.25,
+		help='allowed relative growth of a metric over the baseline')
+	parser.add_argument('--smoke', action='store_true',
+		help='only render every block of the synthetic smoke scenarios, with as many'
+			' blocks as the first --synthetic (default 20)')
+	args = parser.parse_args()
+
+	if args.smoke:
+		try:
+			smoke(*args.synthetic[:1])
+		except RuntimeError as e:
+			print(e)
+			sys.exit(1)
+		return
+
+	global TRACE_MEMORY
+	TRACE_MEMORY = args.trace_memory
+
+	results = {'data': run_isolated(ROOT, not args.no_app)}
+
+	for blocks in args.synthetic:
+		root = tempfile.mkdtemp(prefix='benchmark-')
+		try:
+			synthetic(root, blocks, args.years)
+			results['synthetic-%d' % blocks] = run_isolated(root, not args.no_app)
+		finally:
+			shutil.rmtree(root)
+
+	for scenario, metrics in results.items():
+		print('\n%s' % scenario)
+		for key in sorted(metrics):
+			print('  %-45s %14.4f' % (key, metrics[key]))
+
+	if args.save:
+		with open(args.save, 'w') as f:
+			json.dump(results, f, indent=1, sort_keys=True)
+
+	if args.compare:
+		with open(args.compare) as f:
+			regressions = compare(json.load(f), results, args.tolerance)
+		for scenario, key, before, after in regressions:
+			print('REGRESSION %s %s: %.4f -> %.4f' % (scenario, key, before, after))
+		if regressions:
+			sys.exit(1)
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,70 @@
+"""Hunting block boundaries from data/*.geojson.
+
+Geometries are returned as GeoJSON mappings, so that they can be passed to
+rasterio or shapely without requiring either here.
+"""
+
+import collections
+import glob
+import json
+import os
+
+import store
+
+
+def paths():
+	return sorted(glob.glob(os.path.join(store.DATA_DIR, '*.geojson')))
+
+
+def polygonal(geometry):
+	"""The polygonal parts of a geometry, as a Polygon or MultiPolygon.
+
+	Some boundaries are stored as a GeometryCollection with stray line
+	segments alongside the polygon.
+	"""
+
+	if geometry['type'] in ('Polygon', 'MultiPolygon'):
+		return geometry
+
+	polygons = []
+	for part in geometry.get('geometries', []):
+		part = polygonal(part)
+		if part is None:
+			continue
+		if part['type'] == 'Polygon':
+			polygons.append(part['coordinates'])
+		else:
+			polygons.extend(part['coordinates'])
+
+	if not polygons:
+		return None
+	if len(polygons) == 1:
+		return {'type': 'Polygon', 'coordinates': polygons[0]}
+	return {'type': 'MultiPolygon', 'coordinates': polygons}
+
+
+def load():
+	"""Polygonal boundary of each block, keyed by HUNT_BLOCK."""
+
+	blocks = collections.OrderedDict()
+	for path in paths():
+		with open(path) as f:
+			collection = json.load(f)
+		for feature in collection['features']:
+			name = feature['properties'].get(
+				'HUNT_BLOCK', os.path.splitext(os.path.basename(path))[0]
+			)
+			blocks[name] = polygonal(feature['geometry'])
+	return blocks
+
+
+def _coordinates(geometry):
+	if geometry['type'] == 'Polygon':
+		return [xy for ring in geometry['coordinates'] for xy in ring]
+	return [xy for polygon in geometry['coordinates'] for ring in polygon for xy in ring]
+
+
+def bounds(geometry):
+	"""(west, south, east, north) of a Polygon or MultiPolygon."""
+	xs, ys = zip(*[xy[:2] for xy in _coordinates(geometry)])
+	return min(xs), min(ys), max(xs), max(ys)
@@ -0,0 +1,114 @@
+"""Bounded, expiring memoization of results derived from the datasets.
+
+Datasets themselves are shared, read-only resources held by store.registry.
+Results computed from them for one block and one set of widget values (the
+smoothed series, for instance) are memoized here, keyed by the arguments
+only: unlike st.cache, the returned objects are never hashed, so the cost of
+a hit does not grow with the size of the result.  Each cache holds at most
+`maxsize` entries and entries expire after `ttl` seconds.
+
+Cached results are shared between sessions and must not be modified.  When
+a dataset changes, clear(name) drops only the results derived from it.
+"""
+
+import collections
+import functools
+import threading
+import time
+
+
+DEFAULT_MAXSIZE = 256
+
+DEFAULT_TTL = 60 * 60
+
+# Every memoized function, so that the results derived from a dataset can be
+# dropped when it changes.
+_memos = []
+
+
+class Memo(object):
+
+	def __init__(self, func, maxsize=DEFAULT_MAXSIZE, ttl=DEFAULT_TTL, datasets=None):
+		self.func = func
+		self.maxsize = maxsize
+		self.ttl = ttl
+		self.datasets = datasets
+		self.hits = 0
+		self.misses = 0
+		self._entries = collections.OrderedDict()
+		self._lock = threading.Lock()
+		functools.update_wrapper(self, func)
+
+	def __call__(self, *args, **kwargs):
+
+		key = args + tuple(sorted(kwargs.items()))
+		now = time.monotonic()
+
+		with self._lock:
+			entry = self._entries.get(key)
+			if entry is not None and now - entry[0] < self.ttl:
+				self._entries.move_to_end(key)
+				self.hits += 1
+				return entry[1]
+
+		value = self.func(*args, **kwargs)
+
+		with self._lock:
+			self.misses += 1
+			self._entries[key] = (now, value)
+			self._entries.move_to_end(key)
+			while len(self._entries) > self.maxsize:
+				self._entries.popitem(last=False)
+
+		return value
+
+	def __len__(self):
+		return len(self._entries)
+
+	def clear(self):
+		with self._lock:
+			self._entries.clear()
+
+	def discard(self, name):
+		"""Drop the results derived from dataset `name`."""
+		with self._lock:
+			if self.datasets is not None:
+				if name in self.datasets:
+					self._entries.clear()
+				return
+			for key in [k for k in self._entries if k[:1] == (name,)]:
+				del self._entries[key]
+
+	def info(self):
+		return {
+			'hits': self.hits,
+			'misses': self.misses,
+			'size': len(self._entries),
+			'maxsize': self.maxsize,
+		}
+
+
+def memoize(maxsize=DEFAULT_MAXSIZE, ttl=DEFAULT_TTL, datasets=None):
+	"""Decorator memoizing a function of hashable arguments.
+
+	`datasets` names the datasets the results are derived from.  By default,
+	they are derived from the dataset named by the first argument, as those of
+	smoothing._smoothed are; functions keyed by a content hash or a version
+	stamp instead pass an empty list.
+	"""
+
+	def decorator(func):
+		memo = Memo(func, maxsize, ttl, datasets)
+		_memos.append(memo)
+		return memo
+
+	return decorator
+
+
+def clear(name=None):
+	"""Drop the memoized results derived from dataset `name`, or every one."""
+	for memo in _memos:
+		if name is None:
+			memo.clear()
+		else:
+			memo.discard(name)
@@ -0,0 +1,67 @@
+"""Per-block, per-day-of-year climatology of the daily fire and weather series.
+
+The "Fire anomalies" and "Weather" sections compare the current year against
+a 95 percent confidence band for each day of year.  Rather than shipping every
+historical day to the browser and letting Vega-Lite compute the band, this
+stage aggregates the baseline years once and stores the result as
+data/climatology.arrow (about 366 rows per block).
+
+Run `python climatology.py` after refreshing fires or weather.
+"""
+
+import numpy as np
+import pandas as pd
+
+import store
+
+
+# Daily series summarized, by dataset.
+VARIABLES = {
+	'fires': ['fires'],
+	'weather': ['temp_celsius', 'precip_cm'],
+}
+
+# Years before this one form the baseline.
+CURRENT_YEAR = 2020
+
+
+def summarize(df, variables, before=CURRENT_YEAR):
+	"""Mean, 95 percent CI bounds and count for each block and day of year."""
+
+	# Imported here so that the app can share CURRENT_YEAR without scipy.
+	from scipy import stats
+
+	df = pd.DataFrame({
+		'block': np.asarray(df['block'], dtype=object),
+		'day_of_year': df['day_of_year'].to_numpy(),
+	}).assign(**{v: df[v].to_numpy() for v in variables})[df['year'].to_numpy() < before]
+
+	grouped = df.groupby(['block', 'day_of_year'], sort=False)
+
+	columns = {}
+	for v in variables:
+		agg = grouped[v].agg(['mean', 'std', 'count'])
+		t = stats.t.ppf(0.975, np.maximum(agg['count'] - 1, 1))
+		half = t * agg['std'].fillna(0) / np.sqrt(agg['count'])
+		columns['%s_mean' % v] = agg['mean']
+		columns['%s_lower' % v] = agg['mean'] - half
+		columns['%s_upper' % v] = agg['mean'] + half
+		columns['%s_count' % v] = agg['count']
+
+	return pd.DataFrame(columns).reset_index()
+
+
+def build(before=CURRENT_YEAR):
+
+	frames = [
+		summarize(store.read(name), variables, before).set_index(['block', 'day_of_year'])
+		for name, variables in VARIABLES.items()
+	]
+	climatology = pd.concat(frames, axis=1).sort_index()
+	return climatology.reset_index()
+
+
+if __name__ == '__main__':
+
+	climatology = build()
+	print('%s: %s rows' % (store.write('climatology', climatology), len(climatology)))
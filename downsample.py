@@ -0,0 +1,129 @@
+"""Reduce long daily series to a point budget before they are charted.
+
+Every daily observation since 2001 is more than a chart a few hundred
+pixels wide can show.  Lines are reduced with largest-triangle-three-buckets
+(LTTB), which keeps the visual shape; bars and scatters are reduced to the
+minimum and maximum of each bucket, so that spikes such as fire counts are
+never lost.  Moving averages are reduced with LTTB as well.  Results are
+memoized per block like the smoothed series.
+"""
+
+import numpy as np
+import pandas as pd
+
+import cache
+import smoothing
+import store
+
+
+# Approximate width, in pixels, of a chart in the main column.
+CHART_WIDTH = 700
+
+
+def lttb(y, points):
+	"""Indices of the points kept by largest-triangle-three-buckets.
+
+	Points are assumed evenly spaced, as the daily series are.
+	"""
+
+	y = np.asarray(y, dtype=float)
+	n = len(y)
+	if points >= n or points < 3:
+		return np.arange(n)
+
+	x = np.arange(n, dtype=float)
+	edges = np.linspace(1, n - 1, points - 1).astype(int)
+
+	kept = np.empty(points, dtype=int)
+	kept[0], kept[-1] = 0, n - 1
+
+	a = 0
+	for i in range(points - 2):
+		start, stop = edges[i], edges[i + 1]
+
+		# The average of the next bucket stands in for its chosen point.
+		nxt_start, nxt_stop = stop, edges[i + 2] if i + 2 < len(edges) else n
+		avg_x = x[nxt_start:nxt_stop].mean()
+		avg_y = np.nanmean(y[nxt_start:nxt_stop]) if nxt_stop > nxt_start else y[-1]
+
+		area = np.abs(
+			(x[a] - avg_x) * (y[start:stop] - y[a])
+			- (x[a] - x[start:stop]) * (avg_y - y[a])
+		)
+		a = start + int(np.nanargmax(area)) if np.isfinite(area).any() else start
+		kept[i + 1] = a
+
+	return kept
+
+
+def minmax(y, buckets):
+	"""Indices of the minimum and maximum of each of `buckets` buckets."""
+
+	y = np.asarray(y, dtype=float)
+	n = len(y)
+	if 2 * buckets >= n:
+		return np.arange(n)
+
+	bucket = np.arange(n) * buckets // n
+	# Within each bucket, order by value: the first and last valid values are
+	# the min and max.  NaN sorts last and is only kept if the bucket is all
+	# NaN.
+	order = np.lexsort((y, bucket))
+	starts = np.flatnonzero(np.r_[True, np.diff(bucket[order]) > 0])
+	valid = np.add.reduceat(~np.isnan(y[order]), starts)
+	stops = starts + np.maximum(valid - 1, 0)
+
+	return np.unique(np.r_[order[starts], order[stops]])
+
+
+METHODS = {
+	'lttb': lttb,
+	'minmax': lambda y, points: minmax(y, points // 2),
+}
+
+
+def series(name, block, column, points=CHART_WIDTH, method='lttb'):
+	"""Date and `column` of one block's series, reduced to about `points` rows.
+
+	The result is shared between callers and must not be modified.
+	"""
+	# Keyed on the version of the series, as smoothing.smoothed is.
+	return _series(name, store.version(name), block, column, points, method)
+
+
+@cache.memoize(maxsize=512)
+def _series(name, stamp, block, column, points, method):
+
+	df = store.get_block(name, block)
+	return _frame(df, column, METHODS[method](df[column].to_numpy(), points))
+
+
+def _frame(df, column, rows=slice(None)):
+	# Dates are a categorical over every day of the dataset; charts are sent
+	# only the strings of the rows they show.
+	return pd.DataFrame({
+		'date': np.asarray(df['date'], dtype=object)[rows],
+		column: df[column].to_numpy()[rows],
+	})
+
+
+def chart_data(name, block, column, method='lttb', full_resolution=False):
+	"""Date and `column` for a chart: reduced, or every row when zooming."""
+
+	if full_resolution:
+		return _frame(store.get_block(name, block), column)
+	return series(name, block, column, method=method)
+
+
+def smoothed(name, block, variable, half_window, full_resolution=False):
+	"""smoothing.smoothed for a chart: reduced by LTTB, or every row when zooming."""
+
+	if full_resolution:
+		return smoothing.smoothed(name, block, variable, half_window)
+	return _smoothed(name, store.version(name), block, variable, half_window, CHART_WIDTH)
+
+
+@cache.memoize(maxsize=512)
+def _smoothed(name, stamp, block, variable, half_window, points):
+	df = smoothing.smoothed(name, block, variable, half_window)
+	return df.iloc[lttb(df['rolling_mean'].to_numpy(), points)].reset_index(drop=True)
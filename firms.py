@@ -0,0 +1,145 @@
+"""Assign raw FIRMS fire detections to hunting blocks.
+
+fires.pkl holds daily fire counts per block.  This stage rebuilds it from the
+point detections (a FIRMS CSV with latitude, longitude, acq_date and
+brightness), so that counts can be redone when boundaries change or blocks
+are added.  The CSV is streamed in chunks; each chunk is filtered by the
+brightness threshold and the block bounding box, and the remaining points are
+matched to blocks through an STR-tree over the prepared block polygons.  Only
+the per-(block, day) counts are kept between chunks, so memory is bounded by
+the chunk size regardless of the number of detections.
+
+	python firms.py fire_archive_M6.csv [more.csv ...]
+"""
+
+import argparse
+import collections
+import os
+
+import numpy as np
+import pandas as pd
+
+import boundaries
+import store
+
+
+# Detections at or below this brightness temperature (Kelvin) are dropped.
+THRESHOLD = 300
+
+# The daily series starts on this date.
+START = '2001-01-01'
+
+CHUNKSIZE = 1000000
+
+COLUMNS = ['latitude', 'longitude', 'acq_date', 'brightness']
+
+
+class BlockLocator(object):
+	"""Spatial index of the block polygons for point-in-block queries."""
+
+	def __init__(self, blocks=None):
+
+		import shapely
+		from shapely.geometry import shape
+
+		blocks = blocks or boundaries.load()
+		self.names = np.array([b for b, g in blocks.items() if g is not None], dtype=object)
+		self.polygons = np.array([shape(blocks[b]) for b in self.names])
+		shapely.prepare(self.polygons)
+
+		self.tree = shapely.STRtree(self.polygons)
+		self.bounds = shapely.total_bounds(self.polygons)
+
+	def locate(self, longitude, latitude):
+		"""Indices of the points inside any block, and the block of each.
+
+		A point on overlapping blocks is reported once for each block.
+		"""
+
+		import shapely
+
+		west, south, east, north = self.bounds
+		candidates = np.flatnonzero(
+			(longitude >= west) & (longitude <= east) &
+			(latitude >= south) & (latitude <= north)
+		)
+
+		x, y = longitude[candidates], latitude[candidates]
+
+		# The tree narrows each point to the blocks whose bounding box holds
+		# it; the exact test then runs once per block on its candidates.
+		point, polygon = self.tree.query(shapely.points(x, y))
+		order = np.argsort(polygon, kind='mergesort')
+		point, polygon = point[order], polygon[order]
+
+		inside = np.zeros(len(point), dtype=bool)
+		bounds = np.flatnonzero(np.diff(polygon)) + 1
+		for start, stop in zip(np.r_[0, bounds], np.r_[bounds, len(polygon)]):
+			if stop > start:
+				p = point[start:stop]
+				inside[start:stop] = shapely.contains_xy(self.polygons[polygon[start]], x[p], y[p])
+
+		return candidates[point[inside]], self.names[polygon[inside]]
+
+
+def count_detections(paths, locator=None, threshold=THRESHOLD, chunksize=CHUNKSIZE):
+	"""Number of detections per (block, acq_date) over one or more CSVs."""
+
+	locator = locator or BlockLocator()
+	counts = collections.Counter()
+
+	for path in paths:
+		for chunk in pd.read_csv(path, usecols=COLUMNS, chunksize=chunksize):
+			chunk = chunk[chunk['brightness'] > threshold]
+			index, blocks = locator.locate(
+				chunk['longitude'].to_numpy(), chunk['latitude'].to_numpy()
+			)
+			dates = chunk['acq_date'].to_numpy()[index]
+			daily = pd.Series(1, index=pd.MultiIndex.from_arrays([blocks, dates]))
+			counts.update(daily.groupby(level=[0, 1]).sum().to_dict())
+
+	return counts
+
+
+def daily_counts(counts, blocks, start=START, end=None):
+	"""Complete daily series per block in the layout of fires.pkl."""
+
+	dates = [d for _, d in counts]
+	end = end or (max(dates) if dates else start)
+
+	index = pd.MultiIndex.from_product(
+		[blocks, pd.date_range(start, end).strftime('%Y-%m-%d')],
+		names=['block', 'date']
+	)
+	if counts:
+		fires = pd.Series(counts).reindex(index, fill_value=0)
+	else:
+		fires = pd.Series(0, index=index)
+
+	return pd.DataFrame({
+		'T21': fires.to_numpy(dtype=np.int64),
+		'date': index.get_level_values('date'),
+		'block': index.get_level_values('block'),
+	})
+
+
+if __name__ == '__main__':
+
+	parser = argparse.ArgumentParser(
+		description='Count FIRMS detections per block and day into data/fires.pkl.'
+	)
+	parser.add_argument('csv', nargs='+')
+	parser.add_argument('--threshold', type=float, default=THRESHOLD,
+		help='brightness threshold in Kelvin')
+	parser.add_argument('--start', default=START)
+	parser.add_argument('--chunksize', type=int, default=CHUNKSIZE)
+	args = parser.parse_args()
+
+	locator = BlockLocator()
+	counts = count_detections(args.csv, locator, args.threshold, args.chunksize)
+	fires = daily_counts(counts, list(locator.names), args.start)
+
+	tmp = store.pickle_path('fires') + '.tmp'
+	fires.to_pickle(tmp)
+	os.replace(tmp, store.pickle_path('fires'))
+	print('%s -> %s' % (store.pickle_path('fires'), store.convert('fires')))
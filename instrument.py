@@ -0,0 +1,222 @@
+"""Opt-in timing, allocation and payload instrumentation of the app's sections.
+
+app.py marks the start of each of its sections (ranking, carbon, fires, ...).
+When instrumentation is enabled, every rerun records for each section the
+wall time, the serialized size of the elements it sends to the browser and,
+optionally, the net memory it allocated.  The results are shown in a debug panel
+at the bottom of the page, accumulated for a Prometheus-style text endpoint
+and appended to a log file:
+
+	INSTRUMENT=1 streamlit run app.py
+	INSTRUMENT=1 INSTRUMENT_MEMORY=1 INSTRUMENT_PORT=9100 \\
+		INSTRUMENT_LOG=sections.log streamlit run app.py
+
+Memory is traced with tracemalloc, which slows pandas down several times, so
+it is enabled separately.  When instrumentation is disabled, start() returns
+a recorder whose methods do nothing.
+"""
+
+import collections
+import http.server
+import json
+import os
+import resource
+import threading
+import time
+import tracemalloc
+
+
+def _flag(name):
+	return os.environ.get(name, '') not in ('', '0')
+
+
+ENABLED = _flag('INSTRUMENT')
+
+TRACE_MEMORY = _flag('INSTRUMENT_MEMORY')
+
+# Port of the metrics endpoint, and path of the JSON lines log; off if unset.
+PORT = int(os.environ.get('INSTRUMENT_PORT') or 0)
+
+LOG_PATH = os.environ.get('INSTRUMENT_LOG')
+
+# Fields recorded for each section.
+FIELDS = ['seconds', 'allocated_bytes', 'payload_bytes']
+
+
+def _script_run_ctx():
+	try:
+		from streamlit.runtime.scriptrunner import get_script_run_ctx
+	except ImportError:
+		from streamlit.report_thread import get_report_ctx as get_script_run_ctx
+	return get_script_run_ctx()
+
+
+class Metrics(object):
+	"""Totals per section over every rerun of the process."""
+
+	def __init__(self):
+		self.reruns = 0
+		self.last = []
+		self._totals = collections.OrderedDict()
+		self._lock = threading.Lock()
+
+	def add(self, sections):
+		with self._lock:
+			self.reruns += 1
+			self.last = sections
+			for section in sections:
+				totals = self._totals.setdefault(
+					section['section'], dict.fromkeys(['count'] + FIELDS, 0)
+				)
+				totals['count'] += 1
+				for field in FIELDS:
+					totals[field] += section[field] or 0
+
+	def prometheus(self):
+		"""The totals in the Prometheus text exposition format."""
+
+		with self._lock:
+			lines = [
+				'# HELP app_reruns_total Completed reruns of app.py.',
+				'# TYPE app_reruns_total counter',
+				'app_reruns_total %d' % self.reruns,
+			]
+			for field, help in [
+				('seconds', 'Wall time spent in each section of app.py.'),
+				('allocated_bytes', 'Net memory allocated by each section (with INSTRUMENT_MEMORY).'),
+				('payload_bytes', 'Serialized size of the elements sent by each section.'),
+			]:
+				metric = 'app_section_%s' % field
+				lines += ['# HELP %s %s' % (metric, help), '# TYPE %s summary' % metric]
+				for name, totals in self._totals.items():
+					lines.append('%s_sum{section="%s"} %r' % (metric, name, float(totals[field])))
+					lines.append('%s_count{section="%s"} %d' % (metric, name, totals['count']))
+
+		lines += [
+			'# HELP process_max_resident_bytes Peak resident set size of the process.',
+			'# TYPE process_max_resident_bytes gauge',
+			'process_max_resident_bytes %d' % (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024),
+		]
+		return '\n'.join(lines) + '\n'
+
+
+metrics = Metrics()
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+
+	def do_GET(self):
+		body = metrics.prometheus().encode()
+		self.send_response(200)
+		self.send_header('Content-Type', 'text/plain; version=0.0.4')
+		self.send_header('Content-Length', str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+	def log_message(self, *args):
+		pass
+
+
+_server = None
+_server_lock = threading.Lock()
+
+
+def serve(port=PORT):
+	"""Serve the metrics on `port` from a daemon thread, once per process."""
+
+	global _server
+	with _server_lock:
+		if _server is None:
+			_server = http.server.ThreadingHTTPServer(('', port), _Handler)
+			thread = threading.Thread(
+				target=_server.serve_forever, name='instrument-metrics', daemon=True
+			)
+			thread.start()
+	return _server
+
+
+class Recorder(object):
+	"""Measurements of one rerun, section by section."""
+
+	def __init__(self, trace_memory=None):
+		self.sections = []
+		self.trace_memory = TRACE_MEMORY if trace_memory is None else trace_memory
+		self._current = None
+
+		if self.trace_memory and not tracemalloc.is_tracing():
+			tracemalloc.start()
+
+		# Every element and chart reaches the browser through the context's
+		# enqueue; shadowing it on the instance counts the bytes per section.
+		ctx = _script_run_ctx()
+		if ctx is not None:
+			send = type(ctx).enqueue.__get__(ctx)
+			def enqueue(msg):
+				if self._current is not None:
+					self._current['payload_bytes'] += msg.ByteSize()
+				send(msg)
+			ctx.enqueue = enqueue
+
+	def enter(self, name):
+		"""End the current section, if any, and start the next."""
+
+		now = time.perf_counter()
+		self._close(now)
+		self._current = {
+			'section': name,
+			'seconds': now,
+			'allocated_bytes': tracemalloc.get_traced_memory()[0] if self.trace_memory else None,
+			'payload_bytes': 0,
+		}
+
+	def _close(self, now):
+		section = self._current
+		if section is None:
+			return
+		section['seconds'] = now - section['seconds']
+		if self.trace_memory:
+			section['allocated_bytes'] = tracemalloc.get_traced_memory()[0] - section['allocated_bytes']
+		self.sections.append(section)
+		self._current = None
+
+	def finish(self, panel=True):
+		"""Close the last section, publish the rerun and show the panel."""
+
+		self._close(time.perf_counter())
+		metrics.add(self.sections)
+
+		if LOG_PATH:
+			with open(LOG_PATH, 'a') as f:
+				f.write(json.dumps({'time': time.time(), 'sections': self.sections}) + '\n')
+
+		if panel:
+			import pandas as pd
+			import streamlit as st
+
+			with st.expander('Instrumentation'):
+				table = pd.DataFrame(self.sections).set_index('section')
+				if not self.trace_memory:
+					table = table.drop(columns='allocated_bytes')
+				st.table(table)
+				st.text(metrics.prometheus())
+
+
+class _Disabled(object):
+
+	sections = []
+
+	def enter(self, name):
+		pass
+
+	def finish(self, panel=True):
+		pass
+
+
+def start():
+	"""A recorder for this rerun, which does nothing unless ENABLED."""
+
+	if not ENABLED:
+		return _Disabled()
+	if PORT:
+		serve(PORT)
+	return Recorder()
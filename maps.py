@@ -0,0 +1,266 @@
+"""Multi-resolution block boundaries for the concession map.
+
+The boundaries in data/*.geojson carry up to ~2,000 vertices per block, far
+more than a map of all the concessions can show.  This stage simplifies them
+once for each zoom level in LEVELS, to half a screen pixel at that zoom, and
+writes data/boundaries/z<zoom>.geojson with coordinates rounded to the same
+precision.
+
+Neighbouring blocks share edges, and simplifying each polygon on its own
+would open gaps and overlaps along them.  Instead the boundaries are split
+into arcs at the points where they meet, each arc is simplified once, and
+the blocks are rebuilt from the faces of the simplified arcs, so that shared
+edges stay shared.
+
+	python maps.py
+
+The app draws the least detailed level that resolves its initial view to
+within a pixel, falling back to coarser levels until the boundaries fit
+PAYLOAD_BUDGET.
+
+shapely is only needed to build the levels; the app builds them in memory
+if they have not been written.
+"""
+
+import glob
+import json
+import math
+import os
+
+import numpy as np
+
+import boundaries
+import cache
+import store
+
+
+MAP_DIR = os.path.join(store.DATA_DIR, 'boundaries')
+
+LEVELS = [4, 6, 8, 10, 12]
+
+# Largest size, in bytes, of the boundaries sent with the map.
+PAYLOAD_BUDGET = 200 * 1024
+
+# Size, in pixels, of the map in the page.
+WIDTH = 700
+HEIGHT = 500
+
+# Colors of the lowest and highest ranking weight (tealblues).
+LOW_COLOR = [188, 228, 216]
+HIGH_COLOR = [44, 89, 133]
+
+NO_DATA_COLOR = [200, 200, 200]
+
+
+def tolerance(zoom):
+	"""Half a 256-pixel tile's pixel at `zoom`, in degrees of longitude."""
+	return 360 / (256 * 2 ** zoom) / 2
+
+
+def decimals(zoom):
+	"""Decimal places of the coordinates at `zoom`."""
+	return max(int(math.ceil(-math.log10(tolerance(zoom)))), 0)
+
+
+def level_path(zoom):
+	return os.path.join(MAP_DIR, 'z%d.geojson' % zoom)
+
+
+def arcs(polygons):
+	"""The boundaries of `polygons`, split into arcs where they meet."""
+
+	import shapely
+
+	noded = shapely.union_all([p.boundary for p in polygons])
+	return shapely.get_parts(shapely.line_merge(noded))
+
+
+def simplify(blocks, zoom):
+	"""Blocks simplified for `zoom`, with shared edges kept shared.
+
+	`blocks` maps names to shapely polygons; returns a dict of the same keys.
+	"""
+
+	import shapely
+
+	names = list(blocks)
+	originals = np.array([blocks[n] for n in names])
+
+	lines = shapely.simplify(arcs(originals), tolerance(zoom), preserve_topology=True)
+	# Snapped to the precision they are written with before the faces are
+	# formed, so that rounding cannot make neighbours overlap.
+	lines = shapely.set_precision(lines, 10.0 ** -decimals(zoom))
+	# Simplified arcs may cross where they did not before; noding them again
+	# turns the crossings into small faces rather than invalid ones.
+	faces = shapely.get_parts(shapely.polygonize(shapely.get_parts(shapely.union_all(lines))))
+
+	# Each face goes to the block it overlaps most; faces outside every
+	# block (gaps between them) are dropped.
+	tree = shapely.STRtree(originals)
+	parts = {n: [] for n in names}
+	for face in faces:
+		candidates = tree.query(face)
+		if not len(candidates):
+			continue
+		overlap = shapely.area(shapely.intersection(originals[candidates], face))
+		best = np.argmax(overlap)
+		if overlap[best] > face.area / 2:
+			parts[names[candidates[best]]].append(face)
+
+	simplified = {}
+	for n, original in zip(names, originals):
+		if parts[n]:
+			simplified[n] = shapely.union_all(parts[n])
+		else:
+			# Collapsed at this zoom: simplified on its own instead.
+			simplified[n] = shapely.simplify(original, tolerance(zoom), preserve_topology=True)
+	return simplified
+
+
+def _rounded(geometry, zoom):
+
+	import shapely
+	from shapely.geometry import mapping
+
+	# Clears the floating point noise left by snapping.
+	places = decimals(zoom)
+	return mapping(shapely.transform(geometry, lambda xy: np.round(xy, places)))
+
+
+def build(levels=LEVELS):
+	"""GeoJSON FeatureCollection of the blocks at each zoom level."""
+
+	blocks = {n: g for n, g in boundaries.load().items() if g is not None}
+	if not blocks:
+		return {zoom: {'type': 'FeatureCollection', 'features': []} for zoom in levels}
+
+	from shapely.geometry import shape
+
+	blocks = {n: shape(g) for n, g in blocks.items()}
+	collections = {}
+	for zoom in levels:
+		collections[zoom] = {
+			'type': 'FeatureCollection',
+			'features': [
+				{'type': 'Feature', 'properties': {'block': n}, 'geometry': _rounded(g, zoom)}
+				for n, g in simplify(blocks, zoom).items()
+			],
+		}
+	return collections
+
+
+def write(collections):
+
+	os.makedirs(MAP_DIR, exist_ok=True)
+	for zoom, collection in collections.items():
+		tmp = level_path(zoom) + '.tmp'
+		with open(tmp, 'w') as f:
+			json.dump(collection, f, separators=(',', ':'))
+		os.replace(tmp, level_path(zoom))
+
+
+def _stamp():
+	# Changes whenever a boundary or a written level changes.
+	paths = boundaries.paths() + glob.glob(os.path.join(MAP_DIR, '*.geojson'))
+	return tuple((p, os.stat(p).st_mtime_ns) for p in sorted(paths))
+
+
+@cache.memoize(maxsize=1, datasets=[])
+def _levels(stamp):
+
+	written = {z: level_path(z) for z in LEVELS if os.path.exists(level_path(z))}
+	if len(written) < len(LEVELS):
+		return build()
+
+	collections = {}
+	for zoom, path in written.items():
+		with open(path) as f:
+			collections[zoom] = json.load(f)
+	return collections
+
+
+def levels():
+	"""Boundaries at each zoom level, written by `python maps.py` or built."""
+	return _levels(_stamp())
+
+
+@cache.memoize(maxsize=1, datasets=[])
+def _sizes(stamp):
+	# As sent: pydeck serializes the deck with an indent of 2, which about
+	# quintuples the size of the coordinate arrays.
+	return {
+		z: len(json.dumps(c, sort_keys=True, indent=2)) for z, c in _levels(stamp).items()
+	}
+
+
+def view(collection, width=WIDTH, height=HEIGHT):
+	"""Center and zoom of a view fitting every block of a collection.
+
+	None if the collection has no blocks.
+	"""
+
+	xs, ys = [], []
+	for feature in collection['features']:
+		west, south, east, north = boundaries.bounds(feature['geometry'])
+		xs += [west, east]
+		ys += [south, north]
+	if not xs:
+		return None
+
+	longitude = (min(xs) + max(xs)) / 2
+	latitude = (min(ys) + max(ys)) / 2
+	# Web Mercator: the world is 256 * 2 ** zoom pixels wide.
+	span_x = max(max(xs) - min(xs), 1e-6)
+	span_y = max(max(ys) - min(ys), 1e-6) / math.cos(math.radians(latitude))
+	zoom = math.log2(min(360 * width / span_x, 360 * height / span_y) / 256)
+	return longitude, latitude, max(math.floor(zoom * 10) / 10, 0)
+
+
+def level(zoom, budget=PAYLOAD_BUDGET):
+	"""The level to draw a view at `zoom` with, and its size in bytes.
+
+	The least detailed level that resolves the view (simplified to within a
+	pixel at `zoom`), or a coarser one if that exceeds the budget.
+	"""
+
+	sizes = _sizes(_stamp())
+	zooms = sorted(sizes)
+
+	chosen = ([z for z in zooms if z >= zoom - 1] or zooms[-1:])[0]
+	if sizes[chosen] > budget:
+		chosen = max([z for z in zooms if z < chosen and sizes[z] <= budget], default=zooms[0])
+	return chosen, sizes[chosen]
+
+
+def colored(collection, weights):
+	"""A copy of a collection with each block's weight and fill color.
+
+	`weights` maps block names to ranking weights.
+	"""
+
+	values = np.array(list(weights.values()), dtype=float)
+	low, high = (values.min(), values.max()) if len(values) else (0, 1)
+
+	features = []
+	for feature in collection['features']:
+		block = feature['properties']['block']
+		if block in weights:
+			t = (weights[block] - low) / (high - low) if high > low else 1.0
+			color = [int(round(a + t * (b - a))) for a, b in zip(LOW_COLOR, HIGH_COLOR)]
+			properties = {'block': block, 'weight': '%.2f' % weights[block], 'color': color}
+		else:
+			properties = {'block': block, 'weight': 'n/a', 'color': NO_DATA_COLOR}
+		features.append(dict(feature, properties=properties))
+
+	return dict(collection, features=features)
+
+
+if __name__ == '__main__':
+
+	collections = build()
+	write(collections)
+	for zoom, collection in collections.items():
+		vertices = sum(
+			len(boundaries._coordinates(f['geometry'])) for f in collection['features']
+		)
+		print('%s: %d vertices, %d bytes' % (level_path(zoom), vertices, os.path.getsize(level_path(zoom))))
@@ -0,0 +1,85 @@
+"""Per-block figures quoted in the narrative of each block's page.
+
+Population growth, deforestation, carbon and surface water totals were
+recomputed from the full datasets on every rerun, only to show one block's
+numbers.  This stage computes them for every block at once, with one grouped
+pass over each dataset, and stores the result as data/metrics.arrow (one row
+per block), so the app only looks up a row.
+
+Run `python metrics.py` after refreshing pop, defor, carbon, forestcarbon or
+waterclass.
+"""
+
+import numpy as np
+import pandas as pd
+
+import store
+
+
+def _block_sums(df, columns):
+	return df.groupby('block', sort=False, observed=True)[columns].sum()
+
+
+def population_growth(pop):
+	"""Mean growth rate between successive population estimates, by block.
+
+	Estimates are taken in the order they are stored within each block.
+	"""
+
+	block = np.asarray(pop['block'], dtype=object)
+	population = pop['population'].to_numpy(dtype=float)
+
+	same = np.r_[False, block[1:] == block[:-1]]
+	rate = np.full(len(population), np.nan)
+	with np.errstate(divide='ignore', invalid='ignore'):
+		rate[same] = population[1:][same[1:]] / population[:-1][same[1:]] - 1
+
+	rates = pd.DataFrame({'block': block, 'pop_rate': rate})
+	return rates.groupby('block', sort=False)['pop_rate'].mean()
+
+
+def build(datasets=None):
+	"""The metrics of every block in properties, one row per block.
+
+	`datasets` maps dataset names to frames; missing ones are read from data/.
+	"""
+
+	datasets = datasets or {}
+
+	def get(name):
+		return datasets[name] if name in datasets else store.read(name)
+
+	properties = get('properties')
+	blocks = pd.Index(np.asarray(properties['HUNT_BLOCK'], dtype=object), name='block')
+	area = pd.Series(properties['AREA'].to_numpy(dtype=float), index=blocks)
+
+	carbon = _block_sums(get('carbon'), ['tC', 'frequency']).reindex(blocks)
+	forestcarbon = get('forestcarbon')
+	forest_tC = _block_sums(
+		forestcarbon[forestcarbon['carbon'] > 0], ['tC']
+	)['tC'].reindex(blocks)
+	defor = _block_sums(get('defor'), ['hectares'])['hectares'].reindex(blocks)
+	water = _block_sums(get('waterclass'), ['area_km2'])['area_km2'].reindex(blocks)
+
+	df = pd.DataFrame({
+		'area': area,
+		'pop_rate': population_growth(get('pop')).reindex(blocks),
+		'defor_hectares': defor,
+		# Hectares over square kilometers (x100), as a percentage.
+		'defor_percent': defor / area,
+		'mtC': carbon['tC'] / 1e6,
+		# Each 300m pixel is 9 hectares.
+		'tC_per_ha': carbon['tC'] / carbon['frequency'] / 9,
+		'forest_mtC': forest_tC / 1e6,
+		'forest_carbon_percent': 100 * forest_tC / carbon['tC'],
+		'water_km2': water,
+		'water_percent': 100 * water / area,
+	}, index=blocks)
+
+	return df.reset_index()
+
+
+if __name__ == '__main__':
+
+	metrics = build()
+	print('%s: %s rows' % (store.write('metrics', metrics), len(metrics)))
@@ -0,0 +1,194 @@
+"""Budget-constrained selection of concessions.
+
+Given a score for each concession (the ranking weight) and its cost (the
+total fees), pick the set with the highest total score that fits within a
+budget.  Small problems are solved exactly as a 0/1 knapsack by dynamic
+programming over the budget; larger ones fall back to a branch-and-bound
+search seeded with the greedy solution.
+"""
+
+import numpy as np
+import pandas as pd
+
+
+# Largest (concessions x budget units) table solved exactly.
+MAX_CELLS = 20000000
+
+# Node limit of the branch-and-bound search.
+MAX_NODES = 50000
+
+
+def _unit(costs):
+	"""Largest whole-dollar unit dividing every cost.
+
+	Using it as the step of the dynamic program keeps the solution exact while
+	keeping the table small when fees are round numbers.
+	"""
+	costs = np.round(np.asarray(costs, dtype=float)).astype(np.int64)
+	return max(int(np.gcd.reduce(costs)) if len(costs) else 1, 1)
+
+
+def _units(costs, unit):
+	# Rounded up, so that the selected set never exceeds the budget.
+	return np.ceil(np.asarray(costs, dtype=float) / unit).astype(int)
+
+
+def _table(values, weights, capacity):
+	"""Best value for every capacity 0..capacity, and the items taken."""
+
+	best = np.zeros(capacity + 1)
+	keep = np.zeros((len(values), capacity + 1), dtype=bool)
+
+	for i, (v, w) in enumerate(zip(values, weights)):
+		if w > capacity:
+			continue
+		candidate = best[:capacity + 1 - w] + v
+		improved = candidate > best[w:]
+		keep[i, w:] = improved
+		best[w:] = np.where(improved, candidate, best[w:])
+
+	return best, keep
+
+
+def knapsack(values, costs, budget, unit=None):
+	"""Exact selection by dynamic programming.  Returns a boolean mask."""
+
+	values = np.nan_to_num(np.asarray(values, dtype=float))
+	unit = unit or _unit(costs)
+	weights = _units(costs, unit)
+	capacity = int(budget // unit)
+
+	best, keep = _table(values, weights, capacity)
+
+	selected = np.zeros(len(values), dtype=bool)
+	c = capacity
+	for i in range(len(values) - 1, -1, -1):
+		if keep[i, c]:
+			selected[i] = True
+			c -= weights[i]
+
+	return selected
+
+
+def _by_ratio(values, costs):
+	# Zero-cost concessions come first, then by decreasing score per dollar.
+	with np.errstate(invalid='ignore', divide='ignore'):
+		ratio = np.where(costs > 0, values / costs, np.inf)
+	return np.argsort(-ratio, kind='mergesort')
+
+
+def greedy(values, costs, budget):
+	"""Take concessions by decreasing score per dollar while they fit."""
+
+	values = np.nan_to_num(np.asarray(values, dtype=float))
+	costs = np.asarray(costs, dtype=float)
+
+	selected = np.zeros(len(values), dtype=bool)
+	remaining = budget
+	for i in _by_ratio(values, costs):
+		if costs[i] <= remaining:
+			selected[i] = True
+			remaining -= costs[i]
+
+	# The single best affordable concession bounds the greedy error.
+	affordable = np.flatnonzero(costs <= budget)
+	if len(affordable):
+		single = affordable[np.argmax(values[affordable])]
+		if values[single] > values[selected].sum():
+			selected[:] = False
+			selected[single] = True
+
+	return selected
+
+
+def branch_and_bound(values, costs, budget, max_nodes=MAX_NODES):
+	"""Depth-first branch and bound with the fractional relaxation as bound.
+
+	Starts from the greedy solution and stops after `max_nodes` nodes, so the
+	result is optimal when the search completes and never worse than greedy.
+	"""
+
+	values = np.nan_to_num(np.asarray(values, dtype=float))
+	costs = np.asarray(costs, dtype=float)
+
+	order = _by_ratio(values, costs)
+	v, w = values[order], costs[order]
+	cum_v = np.concatenate([[0.0], np.cumsum(v)])
+	cum_w = np.concatenate([[0.0], np.cumsum(w)])
+	n = len(v)
+
+	def bound(level, value, cost):
+		# Fill the remaining budget with items level.. in ratio order, taking
+		# a fraction of the first one that does not fit.
+		j = np.searchsorted(cum_w, cum_w[level] + budget - cost, side='right') - 1
+		j = min(max(j, level), n)
+		total = value + cum_v[j] - cum_v[level]
+		if j < n and w[j] > 0:
+			total += v[j] * (budget - cost - (cum_w[j] - cum_w[level])) / w[j]
+		return total
+
+	initial = greedy(values, costs, budget)
+	best_value = values[initial].sum()
+	best = None
+
+	# Each node is (level, value, cost, taken), where taken is a linked list
+	# of (position, rest) pairs.
+	stack = [(0, 0.0, 0.0, None)]
+	nodes = 0
+	while stack and nodes < max_nodes:
+		level, value, cost, taken = stack.pop()
+		nodes += 1
+
+		if value > best_value:
+			best_value, best = value, taken
+		if level == n or bound(level, value, cost) <= best_value:
+			continue
+
+		stack.append((level + 1, value, cost, taken))
+		if cost + w[level] <= budget:
+			stack.append((level + 1, value + v[level], cost + w[level], (level, taken)))
+
+	if best is None:
+		return initial
+
+	selected = np.zeros(len(values), dtype=bool)
+	while best is not None:
+		position, best = best
+		selected[order[position]] = True
+	return selected
+
+
+def solve(values, costs, budget, unit=None):
+	"""Best affordable set of concessions, as a boolean mask."""
+
+	unit = unit or _unit(costs)
+	if len(values) * (budget // unit + 1) <= MAX_CELLS:
+		return knapsack(values, costs, budget, unit)
+	return branch_and_bound(values, costs, budget)
+
+
+def frontier(values, costs, budgets, unit=None):
+	"""Best total score attainable at each of several budgets.
+
+	For small problems a single dynamic program up to the largest budget
+	gives the exact frontier at every budget at once.  Otherwise the frontier
+	is that of the greedy prefix in score-per-dollar order.
+	"""
+
+	values = np.nan_to_num(np.asarray(values, dtype=float))
+	costs = np.asarray(costs, dtype=float)
+	budgets = np.asarray(budgets, dtype=float)
+	unit = unit or _unit(costs)
+
+	capacity = int(budgets.max() // unit) if len(budgets) else 0
+
+	if len(values) * (capacity + 1) <= MAX_CELLS:
+		best, _ = _table(values, _units(costs, unit), capacity)
+		score = best[(budgets // unit).astype(int)]
+	else:
+		order = _by_ratio(values, costs)
+		cum_v = np.concatenate([[0.0], np.cumsum(values[order])])
+		cum_w = np.concatenate([[0.0], np.cumsum(costs[order])])
+		score = cum_v[np.searchsorted(cum_w, budgets, side='right') - 1]
+
+	return pd.DataFrame({'budget': budgets, 'score': score})
@@ -0,0 +1,85 @@
+"""Report the import time of the modules loaded by app.py.
+
+Runs the top-level imports of a script in a fresh interpreter under
+`python -X importtime` and summarizes the slowest packages, so that start-up
+can be kept under a budget as features are added:
+
+	python profile_imports.py --budget 3.0
+"""
+
+import argparse
+import ast
+import subprocess
+import sys
+
+
+def top_level_imports(path):
+	"""Import statements at the top level of a script, as source lines."""
+
+	with open(path) as f:
+		tree = ast.parse(f.read(), path)
+
+	def _alias(alias):
+		return alias.name + (' as %s' % alias.asname if alias.asname else '')
+
+	statements = []
+	for node in tree.body:
+		if isinstance(node, ast.Import):
+			statements.append('import %s' % ', '.join(map(_alias, node.names)))
+		elif isinstance(node, ast.ImportFrom):
+			statements.append('from %s%s import %s' % (
+				'.' * node.level,
+				node.module or '',
+				', '.join(map(_alias, node.names))
+			))
+	return statements
+
+
+def importtime(statements):
+	"""Cumulative import time, in seconds, of each package imported."""
+
+	result = subprocess.run(
+		[sys.executable, '-X', 'importtime', '-c', '\n'.join(statements)],
+		stderr=subprocess.PIPE,
+		universal_newlines=True,
+		check=True
+	)
+
+	times = []
+	for line in result.stderr.splitlines():
+		if not line.startswith('import time:') or 'cumulative' in line:
+			continue
+		_, cumulative, name = line[len('import time:'):].split('|')
+		# Nested imports are indented; only the outermost ones add up to the
+		# total.
+		depth = (len(name) - len(name.lstrip())) // 2
+		times.append((name.strip(), int(cumulative) / 1e6, depth))
+
+	return times
+
+
+def main():
+
+	parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+	parser.add_argument('script', nargs='?', default='app.py')
+	parser.add_argument('--top', type=int, default=15,
+		help='number of packages to list')
+	parser.add_argument('--budget', type=float,
+		help='fail if the total import time exceeds this many seconds')
+	args = parser.parse_args()
+
+	times = importtime(top_level_imports(args.script))
+	total = sum(t for _, t, depth in times if depth == 0)
+
+	print('%-40s %10s' % ('package', 'seconds'))
+	for name, t, depth in sorted(times, key=lambda x: -x[1])[:args.top]:
+		print('%-40s %10.3f' % (name, t))
+	print('%-40s %10.3f' % ('total', total))
+
+	if args.budget is not None and total > args.budget:
+		print('Import time exceeds the budget of %.3f seconds' % args.budget)
+		sys.exit(1)
+
+
+if __name__ == '__main__':
+	main()
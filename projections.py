@@ -0,0 +1,260 @@
+"""Per-block summaries of the NASA NEX-GDDP downscaled climate projections.
+
+NEX-GDDP is distributed as one NetCDF file per variable, scenario, model and
+year (e.g. tasmax_day_BCSD_rcp85_r1i1p1_ACCESS1-0_2050.nc), each a daily
+global 0.25 degree grid.  For every file, this stage reads only the window of
+the grid covering the blocks in data/*.geojson, a chunk of days at a time,
+and reduces each day to area-weighted block means: each grid cell is weighted
+by the area of its overlap with the block, precomputed once per grid as a
+sparse (blocks x cells) matrix.  The daily block means are then summarized
+into annual and seasonal (DJF, MAM, JJA, SON, by month within the file's
+year) means.
+
+Files are processed in parallel, and each worker writes its summaries to
+.projections/, so the memory of a worker is bounded by the chunk of days it
+reads, and that of the parent by the summaries (five rows per block per
+file).  A file whose summaries are newer than it is not read again.  The
+summaries of all files are written as data/projections.arrow:
+
+	python projections.py nex-gddp/*.nc [--jobs N] [--chunk DAYS]
+
+Temperatures are converted to degrees Celsius and precipitation to mm/day.
+netCDF4, scipy and shapely are only required to run this module, not the app.
+"""
+
+import argparse
+import concurrent.futures
+import hashlib
+import os
+import re
+
+import numpy as np
+import pandas as pd
+
+import boundaries
+import store
+
+
+BUILD_DIR = '.projections'
+
+# Days read from a file at a time.
+CHUNK_DAYS = 92
+
+FILENAME = re.compile(
+	r'^(?P<variable>[a-z]+)_day_BCSD_(?P<scenario>[a-z0-9]+)_(?P<run>r\d+i\d+p\d+)_'
+	r'(?P<model>.+)_(?P<year>\d{4})\.nc$'
+)
+
+SEASONS = {
+	'DJF': [12, 1, 2],
+	'MAM': [3, 4, 5],
+	'JJA': [6, 7, 8],
+	'SON': [9, 10, 11],
+}
+
+COLUMNS = ['block', 'model', 'scenario', 'variable', 'year', 'period', 'value']
+
+# Grid weights, keyed by a hash of the grid coordinates, for the life of the
+# process.
+_weights = {}
+
+
+def parse(path):
+	"""Variable, scenario, model and year of a NEX-GDDP file name."""
+
+	match = FILENAME.match(os.path.basename(path))
+	if match is None:
+		raise ValueError('%s: not a NEX-GDDP file name' % path)
+	return {
+		'variable': match.group('variable'),
+		'scenario': match.group('scenario'),
+		'model': match.group('model'),
+		'year': int(match.group('year')),
+	}
+
+
+def _convert(values, units):
+	# Kelvin to Celsius and kg m-2 s-1 to mm/day.
+	if units == 'K':
+		return values - 273.15
+	if units in ('kg m-2 s-1', 'kg/m2/s'):
+		return values * 86400
+	return values
+
+
+class GridWeights(object):
+	"""Area weights of the cells of a regular grid within each block.
+
+	Only the window of the grid covering all blocks is kept: `lat` and `lon`
+	are the slices of the window, and `matrix` is a sparse (blocks x cells)
+	matrix over the cells of the window, in row-major order.
+	"""
+
+	def __init__(self, lat, lon, blocks):
+
+		import shapely
+		from scipy import sparse
+		from shapely.geometry import shape
+
+		lat = np.asarray(lat, dtype=float)
+		lon = np.asarray(lon, dtype=float)
+		# Grids in 0-360 longitude, as NEX-GDDP is.
+		shift = 360 if lon.max() > 180 else 0
+
+		self.blocks = [b for b, g in blocks.items() if g is not None]
+		polygons = [shape(blocks[b]) for b in self.blocks]
+		if shift:
+			polygons = [
+				shapely.transform(p, lambda xy: np.column_stack([xy[:, 0] % shift, xy[:, 1]]))
+				for p in polygons
+			]
+		west, south, east, north = shapely.total_bounds(polygons)
+
+		lat_step = abs(lat[1] - lat[0])
+		lon_step = abs(lon[1] - lon[0])
+		rows = np.flatnonzero((lat + lat_step / 2 > south) & (lat - lat_step / 2 < north))
+		cols = np.flatnonzero((lon + lon_step / 2 > west) & (lon - lon_step / 2 < east))
+		self.lat = slice(rows.min(), rows.max() + 1)
+		self.lon = slice(cols.min(), cols.max() + 1)
+
+		# Cell boxes of the window, row-major.
+		y, x = np.meshgrid(lat[self.lat], lon[self.lon], indexing='ij')
+		cells = shapely.box(
+			x.ravel() - lon_step / 2, y.ravel() - lat_step / 2,
+			x.ravel() + lon_step / 2, y.ravel() + lat_step / 2,
+		)
+		# Overlap in square degrees, scaled to area by the cosine of latitude.
+		scale = np.cos(np.radians(y.ravel()))
+
+		data, indices, indptr = [], [], [0]
+		tree = shapely.STRtree(cells)
+		for polygon in polygons:
+			candidates = tree.query(polygon)
+			overlap = shapely.area(shapely.intersection(cells[candidates], polygon)) * scale[candidates]
+			keep = overlap > 0
+			data.append(overlap[keep])
+			indices.append(candidates[keep])
+			indptr.append(indptr[-1] + keep.sum())
+
+		self.matrix = sparse.csr_matrix(
+			(np.concatenate(data), np.concatenate(indices), indptr),
+			shape=(len(polygons), len(cells)),
+		)
+
+	def means(self, values):
+		"""Weighted block means of a (days, lat, lon) window of values.
+
+		Missing cells are left out of each block's mean.  Returns an array of
+		(blocks, days).
+		"""
+
+		values = np.ma.filled(np.ma.masked_invalid(values).astype(float), np.nan)
+		values = values.reshape(len(values), -1).T
+		valid = np.isfinite(values)
+		with np.errstate(divide='ignore', invalid='ignore'):
+			return (self.matrix @ np.where(valid, values, 0)) / (self.matrix @ valid.astype(float))
+
+
+def grid_weights(lat, lon, blocks=None):
+	"""GridWeights of a grid, computed once per grid and process."""
+
+	key = hashlib.sha256(
+		np.asarray(lat, dtype=float).tobytes() + np.asarray(lon, dtype=float).tobytes()
+	).hexdigest()
+	if key not in _weights:
+		_weights[key] = GridWeights(lat, lon, blocks or boundaries.load())
+	return _weights[key]
+
+
+def _months(time):
+	import netCDF4
+	dates = netCDF4.num2date(
+		time[:], time.units, getattr(time, 'calendar', 'standard'),
+		only_use_cftime_datetimes=True,
+	)
+	return np.array([d.month for d in dates])
+
+
+def summarize(path, chunk=CHUNK_DAYS, blocks=None):
+	"""Annual and seasonal block means of one NEX-GDDP file, as a frame."""
+
+	import netCDF4
+
+	meta = parse(path)
+	with netCDF4.Dataset(path) as nc:
+		var = nc.variables[meta['variable']]
+		weights = grid_weights(nc.variables['lat'][:], nc.variables['lon'][:], blocks)
+		months = _months(nc.variables['time'])
+		units = getattr(var, 'units', '')
+
+		# Running sums of the daily means over each month, by block.
+		sums = np.zeros((len(weights.blocks), 12))
+		counts = np.zeros((len(weights.blocks), 12))
+		for start in range(0, len(months), chunk):
+			stop = min(start + chunk, len(months))
+			means = _convert(weights.means(var[start:stop, weights.lat, weights.lon]), units)
+			valid = np.isfinite(means)
+			for m in np.unique(months[start:stop]):
+				days = months[start:stop] == m
+				sums[:, m - 1] += np.where(valid[:, days], means[:, days], 0).sum(axis=1)
+				counts[:, m - 1] += valid[:, days].sum(axis=1)
+
+	periods = dict(annual=list(range(1, 13)), **SEASONS)
+	with np.errstate(divide='ignore', invalid='ignore'):
+		values = {
+			period: sums[:, np.array(m) - 1].sum(axis=1) / counts[:, np.array(m) - 1].sum(axis=1)
+			for period, m in periods.items()
+		}
+
+	return pd.DataFrame({
+		'block': np.repeat(weights.blocks, len(periods)),
+		'model': meta['model'],
+		'scenario': meta['scenario'],
+		'variable': meta['variable'],
+		'year': meta['year'],
+		'period': np.tile(list(periods), len(weights.blocks)),
+		'value': np.column_stack([values[p] for p in periods]).ravel(),
+	})[COLUMNS]
+
+
+def _shard_path(path):
+	return os.path.join(BUILD_DIR, os.path.basename(path) + '.arrow')
+
+
+def _ingest(task):
+	# Runs in a worker: summarizes one file into its shard.
+	path, chunk, force = task
+	shard = _shard_path(path)
+	if force or not os.path.exists(shard) or os.path.getmtime(shard) < os.path.getmtime(path):
+		tmp = '%s.%d.tmp' % (shard, os.getpid())
+		summarize(path, chunk).to_feather(tmp)
+		os.replace(tmp, shard)
+	return shard
+
+
+def ingest(paths, jobs=None, chunk=CHUNK_DAYS, force=False):
+	"""Summaries of every file, read in parallel.  Returns one frame."""
+
+	os.makedirs(BUILD_DIR, exist_ok=True)
+	tasks = [(path, chunk, force) for path in sorted(paths)]
+	with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as pool:
+		shards = list(pool.map(_ingest, tasks))
+
+	return pd.concat([pd.read_feather(shard) for shard in shards], ignore_index=True)
+
+
+if __name__ == '__main__':
+
+	parser = argparse.ArgumentParser(
+		description='Per-block summaries of NEX-GDDP files, written to data/projections.arrow.'
+	)
+	parser.add_argument('paths', nargs='+', help='NEX-GDDP NetCDF files')
+	parser.add_argument('--jobs', type=int, help='number of worker processes')
+	parser.add_argument('--chunk', type=int, default=CHUNK_DAYS,
+		help='days read from a file at a time')
+	parser.add_argument('--force', action='store_true',
+		help='re-read files whose summaries are up to date')
+	args = parser.parse_args()
+
+	df = ingest(args.paths, args.jobs, args.chunk, args.force)
+	print('%s: %d rows' % (store.write('projections', df), len(df)))
@@ -0,0 +1,88 @@
+"""Rank concessions by a weighted combination of the summary criteria.
+
+The normalized criteria (and their per-area variants for the Relative
+scheme) are computed once, so that evaluating a weight vector is a single
+matrix-vector product, and a whole grid of weight vectors is a single
+matrix-matrix product.
+"""
+
+import numpy as np
+import pandas as pd
+
+import cache
+import store
+
+
+# Columns of the summary table, in the order of the weight vectors.
+CRITERIA = ['bio', 'defor', 'pop', 'forest']
+
+SCHEMES = ['Absolute', 'Relative']
+
+
+def weight_vector(human, bio, connectivity):
+	"""Criterion weights for the three slider values.
+
+	Human pressure is split evenly between deforestation and population.  The
+	arguments may be arrays of equal shape, in which case one weight vector is
+	returned per element, stacked along the last axis.
+	"""
+
+	human, bio, connectivity = np.broadcast_arrays(
+		np.asarray(human, dtype=float),
+		np.asarray(bio, dtype=float),
+		np.asarray(connectivity, dtype=float)
+	)
+	denom = human + bio + connectivity
+
+	with np.errstate(invalid='ignore', divide='ignore'):
+		return np.stack([
+			bio / denom,
+			human / denom / 2,
+			human / denom / 2,
+			connectivity / denom
+		], axis=-1)
+
+
+class Ranking(object):
+
+	def __init__(self, summary):
+
+		x = summary[CRITERIA].to_numpy(dtype=float)
+		area = summary['area'].to_numpy(dtype=float)
+
+		self.blocks = np.asarray(summary['block'], dtype=object)
+		self.criteria = {
+			'Absolute': x / x.max(axis=0),
+			'Relative': x / x.max(axis=0) / area[:, np.newaxis],
+		}
+
+	def scores(self, weights, scheme='Absolute'):
+		"""Normalized weights of every block for one or more weight vectors.
+
+		`weights` is a vector of len(CRITERIA), or a (k, len(CRITERIA)) array
+		of them, for which an (n_blocks, k) array is returned.  Each column is
+		scaled so that its highest-ranked block scores 1.
+		"""
+
+		weights = np.asarray(weights, dtype=float)
+		wt = self.criteria[scheme] @ weights.T
+
+		with np.errstate(invalid='ignore', divide='ignore'):
+			return wt / wt.max(axis=0)
+
+	def rank(self, weights, scheme='Absolute'):
+		"""Blocks and their normalized weight for a single weight vector."""
+		return pd.DataFrame({
+			'block': self.blocks,
+			'wt': self.scores(weights, scheme)
+		})
+
+
+@cache.memoize(maxsize=1, datasets=[])
+def _load(stamp):
+	return Ranking(store.load('summary'))
+
+
+def load():
+	"""Ranking over data/summary, built once per version of it."""
+	return _load(store.version('summary'))
@@ -0,0 +1,295 @@
+"""Pre-rendered block pages, served from a content-addressed cache.
+
+For a given block and version of the data, the block sections of the page
+are the same for every visitor who leaves the widgets at their defaults.
+app.py draws those sections through a Page, which records each paragraph,
+chart and widget as it is drawn.  When every widget was at its default,
+the recording is written to data/reports/ under a key hashed from the block,
+the content of the datasets and the code, and the next view of that block
+replays it instead of recomputing the sections.  Any change to the data or
+the code changes the key, so stale reports are never served.
+
+Reports are written through by the app on first view, and can be rendered
+ahead of time for every block, in parallel:
+
+	python reports.py [--jobs N]
+
+which then removes the reports that are no longer current, since every
+change to the data or the code writes a new set.
+
+Set REPORT_CACHE=0 to always recompute the page.
+"""
+
+import concurrent.futures
+import glob
+import hashlib
+import importlib
+import json
+import os
+import pickle
+
+import anomalies
+import cache
+import store
+
+
+ENABLED = os.environ.get('REPORT_CACHE', '1') != '0'
+
+REPORT_DIR = os.path.join(store.DATA_DIR, 'reports')
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# Datasets read by the block sections of the page.
+DATASETS = [
+	'properties', 'summary', 'buildings', 'population', 'metrics', 'carbon',
+	'soil', 'forestcarbon', 'fires', 'climatology', 'defor', 'waterclass', 'vi',
+	'evapotranspiration', 'weather', 'projections',
+]
+
+# Files derived from the datasets that the page reads, when present.
+FILES = [anomalies.FLAGS_PATH]
+
+# Bumped when the layout of a report changes.
+FORMAT = 1
+
+# Libraries whose objects are pickled in a report, or that draw it.
+LIBRARIES = ['altair', 'plotly', 'streamlit']
+
+
+@cache.memoize(maxsize=1, datasets=[])
+def library_versions():
+	"""Version of each of LIBRARIES, or None for those not installed."""
+
+	versions = {}
+	for name in LIBRARIES:
+		try:
+			versions[name] = importlib.import_module(name).__version__
+		except ImportError:
+			versions[name] = None
+	return versions
+
+
+def report_key(block):
+	"""Content address of a block's report for the current data, code and libraries."""
+
+	digest = hashlib.sha256(
+		json.dumps([FORMAT, block, library_versions()], sort_keys=True).encode()
+	)
+	for name in DATASETS:
+		digest.update(store.dataset_digest(name).encode())
+	for path in FILES:
+		if os.path.exists(path):
+			digest.update(store.file_digest(path).encode())
+	for path in sorted(glob.glob(os.path.join(ROOT, '*.py'))):
+		digest.update(store.file_digest(path).encode())
+	return digest.hexdigest()
+
+
+def report_path(key):
+	return os.path.join(REPORT_DIR, key[:2], '%s.pkl' % key)
+
+
+@cache.memoize(maxsize=256, datasets=[])
+def _read(key):
+	with open(report_path(key), 'rb') as f:
+		return pickle.load(f)
+
+
+def load(key):
+	"""The entries of a stored report, or None."""
+	# Only hits are memoized, so a report written by another process is
+	# picked up on the next view.
+	if not os.path.exists(report_path(key)):
+		return None
+	try:
+		return _read(key)
+	except Exception:
+		# A truncated report, or one pickled by other versions of the
+		# libraries, is a miss, and is written again.
+		try:
+			os.remove(report_path(key))
+		except FileNotFoundError:
+			pass
+		return None
+
+
+def save(key, entries):
+
+	path = report_path(key)
+	os.makedirs(os.path.dirname(path), exist_ok=True)
+	tmp = '%s.%d.tmp' % (path, os.getpid())
+	with open(tmp, 'wb') as f:
+		pickle.dump(entries, f, pickle.HIGHEST_PROTOCOL)
+	os.replace(tmp, path)
+
+
+def _widget(st, entry):
+	if entry['type'] == 'selectbox':
+		return st.selectbox(entry['label'], entry['options'], key=entry['key'])
+	return st.slider(
+		entry['label'], entry['min'], entry['max'], entry['default'], key=entry['key']
+	)
+
+
+def render(entries):
+	"""Draw the entries of a report."""
+
+	import streamlit as st
+
+	for entry in entries:
+		if entry['type'] == 'markdown':
+			st.markdown(entry['body'])
+		elif entry['type'] == 'altair':
+			st.altair_chart(entry['figure'], use_container_width=True)
+		elif entry['type'] == 'plotly':
+			st.plotly_chart(entry['figure'], use_container_width=True)
+		else:
+			_widget(st, entry)
+
+
+class Page(object):
+	"""The block sections of the page, drawn and recorded for replay.
+
+	`defaults` is False when a widget drawn before the page (the full
+	resolution checkbox) is not at its default, in which case the page is
+	neither served from nor written to the cache.
+	"""
+
+	def __init__(self, block, defaults=True):
+		self.block = block
+		self.defaults = defaults and ENABLED
+		self.key = report_key(block) if self.defaults else None
+		self.entries = []
+		self.served = False
+		self._cached = None
+
+	def cached(self):
+		"""Whether a report is stored and every widget in it is at its default."""
+
+		if not self.defaults:
+			return False
+		self._cached = load(self.key)
+		if self._cached is None:
+			return False
+
+		import streamlit as st
+
+		return all(
+			st.session_state.get(entry['key'], entry['default']) == entry['default']
+			for entry in self._cached if 'key' in entry
+		)
+
+	def serve(self):
+		"""Replay the stored report; only valid after cached() is True."""
+		render(self._cached)
+		self.served = True
+
+	def _record(self, entry):
+		if self.defaults:
+			self.entries.append(entry)
+
+	def markdown(self, body):
+		import streamlit as st
+		st.markdown(body)
+		self._record({'type': 'markdown', 'body': body})
+
+	def altair_chart(self, chart):
+		import streamlit as st
+		st.altair_chart(chart, use_container_width=True)
+		self._record({'type': 'altair', 'figure': chart})
+
+	def plotly_chart(self, figure):
+		import streamlit as st
+		st.plotly_chart(figure, use_container_width=True)
+		self._record({'type': 'plotly', 'figure': figure})
+
+	def _widget(self, entry):
+		import streamlit as st
+		value = _widget(st, entry)
+		if value != entry['default']:
+			self.defaults = False
+		self._record(entry)
+		return value
+
+	def selectbox(self, label, options, key):
+		return self._widget({
+			'type': 'selectbox', 'label': label, 'options': list(options),
+			'key': key, 'default': options[0],
+		})
+
+	def slider(self, label, min_value, max_value, value, key):
+		return self._widget({
+			'type': 'slider', 'label': label, 'min': min_value, 'max': max_value,
+			'key': key, 'default': value,
+		})
+
+	def save(self):
+		"""Store the recording if every widget stayed at its default."""
+		if self.defaults and not self.served and self.entries:
+			save(self.key, self.entries)
+
+
+def _render_block(block):
+	# Runs in a worker: draws the page for one block, which writes its report.
+	from streamlit.testing.v1 import AppTest
+
+	at = AppTest.from_file(os.path.join(ROOT, 'app.py'), default_timeout=600)
+	at.run()
+	if block != at.selectbox(key='block').value:
+		at.selectbox(key='block').select(block).run()
+	if at.exception:
+		raise RuntimeError('%s: %s' % (block, [e.value for e in at.exception]))
+	return block, load(report_key(block)) is not None
+
+
+def _blocks():
+	return [str(b) for b in store.load('properties')['HUNT_BLOCK']]
+
+
+def prune():
+	"""Remove every report that is not the current one of its block.
+
+	Returns the number removed.
+	"""
+
+	current = {report_key(block) for block in _blocks()}
+	removed = 0
+	for path in glob.glob(os.path.join(REPORT_DIR, '*', '*.pkl')):
+		if os.path.splitext(os.path.basename(path))[0] not in current:
+			try:
+				os.remove(path)
+				removed += 1
+			except FileNotFoundError:
+				pass
+	return removed
+
+
+def render_all(blocks=None, jobs=None):
+	"""Write the report of every block.  Returns the blocks rendered.
+
+	Once every block has rendered, the reports of earlier data and code are
+	pruned.
+	"""
+
+	blocks = blocks or _blocks()
+	with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as pool:
+		rendered = [block for block, ok in pool.map(_render_block, blocks) if ok]
+	if len(rendered) == len(blocks):
+		prune()
+	return rendered
+
+
+if __name__ == '__main__':
+
+	import argparse
+
+	parser = argparse.ArgumentParser(description='Pre-render the page of every block.')
+	parser.add_argument('blocks', nargs='*', help='blocks to render (default: all)')
+	parser.add_argument('--jobs', type=int, help='number of worker processes')
+	args = parser.parse_args()
+
+	# Through the module rather than __main__: AppTest replaces __main__ in
+	# the workers, where the task function is looked up by name.
+	import reports
+	rendered = reports.render_all(args.blocks, args.jobs)
+	print('%d reports in %s' % (len(rendered), REPORT_DIR))
@@ -0,0 +1,171 @@
+"""Compact in-memory types for the columns of each dataset.
+
+The pickles hold the block name as an object string on every row, dates as
+YYYY-MM-DD strings and measurements as 64-bit numbers.  Each dataset here
+declares narrower types: blocks and other labels are categoricals, dates are
+an ordered categorical of their YYYY-MM-DD strings (an integer code per row,
+which still sorts and compares by date and charts as before), and
+measurements are float32 or the smallest integer type that holds them.
+Totals that are summed over whole blocks (tC) are kept in 64 bits.
+
+store.prepare applies the types whenever a dataset is read, and store.write
+validates a dataset against them before it is stored, so a value that would
+not survive the cast is rejected at ingest rather than silently altered.
+
+	python schema.py [name ...]
+
+reports the memory of each dataset before and after.
+"""
+
+import numpy as np
+import pandas as pd
+
+
+# Column types other than numpy dtypes.
+BLOCK = 'block'
+LABEL = 'label'
+DATE = 'date'
+
+_SERIES = {'block': BLOCK, 'date': DATE, 'year': 'int16', 'day_of_year': 'int16'}
+
+_HISTOGRAM = {'block': BLOCK, 'frequency': 'int32', 'carbon': 'float32', 'tC': 'float64'}
+
+_BAND = {'mean': 'float32', 'lower': 'float32', 'upper': 'float32', 'count': 'int16'}
+
+SCHEMAS = {
+	'properties': {'HUNT_BLOCK': BLOCK, 'OUTFITTER2': LABEL},
+	'summary': {'block': BLOCK},
+	'metrics': {'block': BLOCK},
+	'buildings': {'block': BLOCK, 'buildings': 'int32'},
+	'population': {'block': BLOCK, 'population2018': 'int32'},
+	'pop': {'block': BLOCK, 'date': DATE, 'population': 'float32'},
+	'carbon': _HISTOGRAM,
+	'forestcarbon': _HISTOGRAM,
+	'soil': {'block': BLOCK, 'frequency': 'int32', 'carbon_g_per_kg': 'int16', 'depth': LABEL},
+	'defor': {'block': BLOCK, 'year': 'int16', 'hectares': 'int32'},
+	'waterclass': {'block': BLOCK, 'area_km2': 'float32', 'water_label': LABEL},
+	'fires': dict(_SERIES, fires='int16'),
+	'weather': dict(_SERIES, temp_celsius='float32', precip_cm='float32'),
+	'evapotranspiration': dict(_SERIES, evapotranspiration='float32'),
+	'vi': dict(_SERIES, NDVI='float32', EVI='float32'),
+	'projections': {
+		'block': BLOCK, 'model': LABEL, 'scenario': LABEL, 'variable': LABEL,
+		'year': 'int16', 'period': LABEL, 'value': 'float32',
+	},
+	'climatology': dict(
+		{'block': BLOCK, 'day_of_year': 'int16'},
+		**{
+			'%s_%s' % (variable, stat): dtype
+			for variable in ['fires', 'temp_celsius', 'precip_cm']
+			for stat, dtype in _BAND.items()
+		}
+	),
+}
+
+
+def _labels(values):
+	# Categories in order of first appearance, as the blocks are stored.
+	if isinstance(values.dtype, pd.CategoricalDtype):
+		return values
+	return pd.Categorical(values, categories=pd.unique(values))
+
+
+def _dates(values):
+	if isinstance(values.dtype, pd.CategoricalDtype) and values.cat.ordered:
+		return values
+	strings = np.asarray(values.astype(str), dtype=object)
+	return pd.Categorical(strings, categories=np.sort(pd.unique(strings)), ordered=True)
+
+
+def apply(name, df):
+	"""Cast the columns of a dataset to their compact types.
+
+	Columns without a declared type, and datasets without a schema, are left
+	as they are.
+	"""
+
+	columns = {}
+	for column, dtype in SCHEMAS.get(name, {}).items():
+		if column not in df:
+			continue
+		values = df[column]
+		if dtype in (BLOCK, LABEL):
+			cast = _labels(values)
+		elif dtype == DATE:
+			cast = _dates(values)
+		elif values.dtype != dtype:
+			cast = values.to_numpy().astype(dtype)
+		else:
+			continue
+		if cast is not values:
+			columns[column] = cast
+
+	return df.assign(**columns) if columns else df
+
+
+def validate(name, df):
+	"""Raise ValueError if a dataset cannot be stored in its compact types."""
+
+	for column, dtype in SCHEMAS.get(name, {}).items():
+		if column not in df:
+			raise ValueError('%s: missing column %r' % (name, column))
+		values = df[column]
+
+		if dtype in (BLOCK, LABEL):
+			if values.isna().any():
+				raise ValueError('%s: %r has missing values' % (name, column))
+
+		elif dtype == DATE:
+			dates = pd.to_datetime(values.astype(str), format='%Y-%m-%d', errors='coerce')
+			if dates.isna().any():
+				raise ValueError('%s: %r is not all YYYY-MM-DD dates' % (name, column))
+
+		elif np.issubdtype(np.dtype(dtype), np.integer):
+			x = values.to_numpy()
+			info = np.iinfo(dtype)
+			if len(x) and (
+				not np.isfinite(x).all()
+				or (x != np.round(x)).any()
+				or x.min() < info.min or x.max() > info.max
+			):
+				raise ValueError('%s: %r does not fit in %s' % (name, column, dtype))
+
+		else:
+			x = values.to_numpy(dtype=float)
+			if (np.abs(x[np.isfinite(x)]) > np.finfo(dtype).max).any():
+				raise ValueError('%s: %r does not fit in %s' % (name, column, dtype))
+
+
+def report(names=None):
+	"""Memory of each pickled dataset as loaded before and after the schema."""
+
+	import os
+
+	import store
+
+	names = names or [
+		n for n in store.datasets()
+		if n in SCHEMAS and os.path.exists(store.pickle_path(n))
+	]
+	rows = []
+	for name in names:
+		source = pd.read_pickle(store.pickle_path(name))
+		compact = store.prepare(name, source)
+		rows.append({
+			'dataset': name,
+			'rows': len(source),
+			'before_bytes': int(source.memory_usage(deep=True).sum()),
+			'after_bytes': int(compact.memory_usage(deep=True).sum()),
+		})
+
+	df = pd.DataFrame(rows)
+	df['ratio'] = df['before_bytes'] / df['after_bytes']
+	return df
+
+
+if __name__ == '__main__':
+
+	import sys
+
+	with pd.option_context('display.width', 120):
+		print(report(sys.argv[1:]).to_string(index=False))
@@ -0,0 +1,243 @@
+"""Find the areas most similar to a concession, and matched controls.
+
+Each area is described by a feature vector: the summary criteria, the shape
+of its carbon and soil carbon distributions, and the seasonal profiles of
+fires and of the vegetation index.  Features are standardized, and each group
+of features is scaled to carry the same total weight, so that the twelve
+monthly values of a profile do not outweigh the single value of a summary
+criterion.
+
+Index answers k-nearest-neighbour queries: by brute force over all areas when
+there are few of them, and otherwise through a KD-tree, which answers a query
+over tens of thousands of candidate areas in milliseconds.  match() pairs
+treated areas with controls, either directly on the features or on a
+propensity score.
+"""
+
+import numpy as np
+import pandas as pd
+
+import cache
+import store
+
+
+# Datasets the features are built from.
+DATASETS = ['summary', 'carbon', 'soil', 'climatology', 'vi']
+
+SUMMARY = ['area', 'pop_rate', 'pop', 'defor', 'defor_rate', 'bio_rate', 'bio', 'forest_rate', 'forest']
+
+# Edges of the carbon density bins, in tC/ha.
+CARBON_BINS = [0, 10, 25, 50, 75, 100, np.inf]
+
+SOIL_DEPTHS = ['0cm', '10cm', '30cm', '60cm', '100cm', '200cm']
+
+# Up to this many areas, queries compare against every area.
+BRUTE_FORCE_MAX = 2000
+
+
+def _month(day_of_year):
+	# Twelve equal seasonal bins standing in for calendar months.
+	return np.minimum((np.asarray(day_of_year, dtype=int) - 1) * 12 // 366, 11)
+
+
+def _shares(df, value, bins, prefix):
+	# Share of the pixels of each block in each bin of `value`.
+	bin = np.digitize(df[value].to_numpy(dtype=float), bins[1:-1])
+	counts = pd.DataFrame({
+		'block': np.asarray(df['block'], dtype=object),
+		'bin': bin,
+		'frequency': df['frequency'].to_numpy(dtype=float),
+	}).pivot_table(index='block', columns='bin', values='frequency', aggfunc='sum', fill_value=0)
+	counts = counts.reindex(columns=range(len(bins) - 1), fill_value=0)
+	counts.columns = ['%s_%d' % (prefix, c) for c in counts.columns]
+	return counts.div(counts.sum(axis=1), axis=0)
+
+
+def _profile(df, value, prefix):
+	# Mean of `value` over each seasonal bin, by block.
+	profile = pd.DataFrame({
+		'block': np.asarray(df['block'], dtype=object),
+		'month': _month(df['day_of_year']),
+		'value': df[value].to_numpy(dtype=float),
+	}).pivot_table(index='block', columns='month', values='value', aggfunc='mean')
+	profile.columns = ['%s_m%02d' % (prefix, m + 1) for m in profile.columns]
+	return profile
+
+
+def _soil(soil):
+	# Mean soil carbon density at each depth.
+	df = pd.DataFrame({
+		'block': np.asarray(soil['block'], dtype=object),
+		'depth': np.asarray(soil['depth'], dtype=object),
+		'weighted': soil['carbon_g_per_kg'].to_numpy(dtype=float) * soil['frequency'].to_numpy(dtype=float),
+		'frequency': soil['frequency'].to_numpy(dtype=float),
+	}).groupby(['block', 'depth']).sum()
+	mean = (df['weighted'] / df['frequency']).unstack('depth')
+	mean = mean.reindex(columns=SOIL_DEPTHS)
+	mean.columns = ['soil_%s' % d for d in mean.columns]
+	return mean
+
+
+def build_features(summary, carbon, soil, climatology, vi):
+	"""Feature groups of every block in the summary, as one frame.
+
+	Columns are a MultiIndex of (group, feature).
+	"""
+
+	blocks = pd.Index(np.asarray(summary['block'], dtype=object), name='block')
+	groups = {
+		'summary': summary.set_index(blocks)[SUMMARY].astype(float),
+		'carbon': _shares(carbon, 'carbon', CARBON_BINS, 'carbon'),
+		'soil': _soil(soil),
+		'fires': _profile(climatology, 'fires_mean', 'fires'),
+		'vegetation': _profile(vi, 'NDVI', 'ndvi'),
+	}
+	return pd.concat(
+		{name: group.reindex(blocks) for name, group in groups.items()}, axis=1
+	)
+
+
+def _stamp():
+	# Changes whenever one of the datasets does.
+	return tuple(store.version(name) for name in DATASETS)
+
+
+@cache.memoize(maxsize=1, datasets=[])
+def _features(stamp):
+	return build_features(*[store.load(name) for name in DATASETS])
+
+
+def features():
+	"""Features of every block in data/."""
+	return _features(_stamp())
+
+
+def standardize(features):
+	"""Standardized features, with each group weighted equally.
+
+	Missing values are set to the mean, so that they do not count towards
+	any distance.
+	"""
+
+	x = features.to_numpy(dtype=float)
+	mean = np.nanmean(x, axis=0)
+	std = np.nanstd(x, axis=0)
+	std[~(std > 0)] = 1
+
+	z = np.nan_to_num((x - mean) / std)
+
+	group = features.columns.get_level_values(0)
+	sizes = pd.Series(group).map(pd.Series(group).value_counts()).to_numpy()
+	return z / np.sqrt(sizes)
+
+
+class Index(object):
+	"""Nearest-neighbour index of areas by their standardized features."""
+
+	def __init__(self, features, brute_force_max=BRUTE_FORCE_MAX):
+
+		self.areas = np.asarray(features.index, dtype=object)
+		self.positions = {a: i for i, a in enumerate(self.areas)}
+		self.x = standardize(features)
+		self.tree = None
+
+		if len(self.areas) > brute_force_max:
+			from scipy.spatial import cKDTree
+			self.tree = cKDTree(self.x)
+
+	def _vector(self, area):
+		return self.x[self.positions[area]]
+
+	def query(self, area, k=5):
+		"""The k areas nearest to `area` (excluding it), nearest first.
+
+		Returns a frame of area and distance.
+		"""
+
+		k = min(k, len(self.areas) - 1)
+		if k < 1:
+			return pd.DataFrame({'area': [], 'distance': []})
+
+		x = self._vector(area)
+		if self.tree is None:
+			distance = np.sqrt(((self.x - x) ** 2).sum(axis=1))
+			distance[self.positions[area]] = np.inf
+			nearest = np.argpartition(distance, k - 1)[:k]
+			nearest = nearest[np.argsort(distance[nearest])]
+			distance = distance[nearest]
+		else:
+			distance, nearest = self.tree.query(x, k + 1)
+			keep = nearest != self.positions[area]
+			distance, nearest = distance[keep][:k], nearest[keep][:k]
+
+		return pd.DataFrame({'area': self.areas[nearest], 'distance': distance})
+
+
+@cache.memoize(maxsize=1, datasets=[])
+def _index(stamp):
+	return Index(_features(stamp))
+
+
+def index():
+	"""Index of the features of every block in data/."""
+	return _index(_stamp())
+
+
+def similar(block, k=5):
+	"""The k blocks most similar to `block`, with their feature distance."""
+	return index().query(block, k)
+
+
+def propensity(x, treated, ridge=1.0, iterations=25):
+	"""Probability of treatment given standardized features `x`.
+
+	Fitted by L2-penalized logistic regression (Newton's method), which stays
+	finite when a few treated areas are perfectly separable from the rest.
+	"""
+
+	x = np.column_stack([np.ones(len(x)), x])
+	y = np.asarray(treated, dtype=float)
+	penalty = ridge * np.eye(x.shape[1])
+	penalty[0, 0] = 0
+
+	beta = np.zeros(x.shape[1])
+	for _ in range(iterations):
+		p = 1 / (1 + np.exp(-(x @ beta)))
+		gradient = x.T @ (y - p) - penalty @ beta
+		hessian = (x * (p * (1 - p))[:, np.newaxis]).T @ x + penalty
+		step = np.linalg.solve(hessian, gradient)
+		beta += step
+		if np.abs(step).max() < 1e-8:
+			break
+
+	return 1 / (1 + np.exp(-(x @ beta)))
+
+
+def match(index, treated, k=1, method='nearest', caliper=None):
+	"""Control areas matched to each treated area, with replacement.
+
+	`method` is 'nearest' to match on the features, or 'propensity' to match
+	on the estimated propensity score.  Matches further than `caliper` are
+	dropped.  Returns a frame of treated, control and distance.
+	"""
+
+	treated = list(treated)
+	is_treated = np.isin(index.areas, treated)
+	controls = np.flatnonzero(~is_treated)
+	k = min(k, len(controls))
+
+	if method == 'propensity':
+		score = propensity(index.x, is_treated)
+		x, candidates = score[:, np.newaxis], score[controls, np.newaxis]
+	else:
+		x, candidates = index.x, index.x[controls]
+
+	rows = []
+	for area in treated:
+		distance = np.sqrt(((candidates - x[index.positions[area]]) ** 2).sum(axis=1))
+		nearest = np.argpartition(distance, k - 1)[:k] if k else []
+		for i in sorted(nearest, key=lambda i: distance[i]):
+			if caliper is None or distance[i] <= caliper:
+				rows.append((area, index.areas[controls[i]], distance[i]))
+
+	return pd.DataFrame(rows, columns=['treated', 'control', 'distance'])
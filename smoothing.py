@@ -0,0 +1,69 @@
+"""Server-side centered moving averages for the daily series.
+
+The charts used to send every daily row to the browser with a Vega-Lite
+window transform, so each move of a smoothing slider re-serialized the raw
+series.  Here the moving averages are computed from a cumulative sum and
+memoized per (dataset, block, variable, window), so the charts only receive
+the smoothed points and a repeated window is a cache lookup.
+"""
+
+import numpy as np
+import pandas as pd
+
+import cache
+import store
+
+
+def rolling_means(values, half_windows):
+	"""Centered moving averages of `values` for several half-window sizes.
+
+	Row i of the result for half-window h is the mean of values[i - h : i + h + 1],
+	truncated at both ends of the series and ignoring NaN, which matches a
+	Vega-Lite window transform with frame [-h, h].  Returns an array of shape
+	(len(half_windows), len(values)).
+	"""
+
+	values = np.asarray(values, dtype=float)
+	valid = ~np.isnan(values)
+
+	sums = np.concatenate([[0.0], np.cumsum(np.where(valid, values, 0.0))])
+	counts = np.concatenate([[0], np.cumsum(valid)])
+
+	n = len(values)
+	half = np.asarray(half_windows, dtype=int)[:, np.newaxis]
+	i = np.arange(n)[np.newaxis, :]
+	lo = np.clip(i - half, 0, n)
+	hi = np.clip(i + half + 1, 0, n)
+
+	with np.errstate(invalid='ignore', divide='ignore'):
+		return (sums[hi] - sums[lo]) / (counts[hi] - counts[lo])
+
+
+def rolling_mean(values, half_window):
+	return rolling_means(values, [half_window])[0]
+
+
+def smoothed(name, block, variable, half_window, year=None):
+	"""Moving average of one block's series, optionally within a single year.
+
+	Returns a frame of date, day_of_year and rolling_mean.  The result is
+	shared between callers and must not be modified.
+	"""
+	# Keyed on the version of the series, so that an append is seen as soon
+	# as it is stored.
+	return _smoothed(name, store.version(name), block, variable, half_window, year)
+
+
+@cache.memoize(maxsize=512)
+def _smoothed(name, stamp, block, variable, half_window, year=None):
+
+	df = store.get_block(name, block)
+
+	if year is not None:
+		df = df[df['year'] == year]
+
+	return pd.DataFrame({
+		'date': df['date'].to_numpy(),
+		'day_of_year': df['day_of_year'].to_numpy(),
+		'rolling_mean': rolling_mean(df[variable].to_numpy(), half_window),
+	})
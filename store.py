@@ -0,0 +1,397 @@
+"""Columnar, memory-mapped storage for the datasets in data/.
+
+Each dataset is written as an Arrow IPC (Feather v2) file holding a single
+record batch, with its rows grouped by hunting block.  Files are opened
+through a memory map, so the numeric column buffers live in the page cache
+and are shared by every server process instead of being unpickled into
+private copies.
+
+Run `python store.py` to migrate the existing data/*.pkl files.
+"""
+
+import os
+import sys
+import glob
+import hashlib
+import collections
+import threading
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+import cache
+import schema
+import timeseries
+
+
+DATA_DIR = 'data'
+
+# Column identifying the hunting block in each dataset, where it is not
+# simply "block".
+BLOCK_COLUMNS = {
+	'properties': 'HUNT_BLOCK',
+}
+
+# Source columns that are renamed when a dataset is read.
+RENAMES = {
+	'fires': {'T21': 'fires'},
+	'evapotranspiration': {'L1_RET_E': 'evapotranspiration'},
+}
+
+# Memory budget, in bytes, for the datasets held by each process.  Once it
+# is exceeded, the least recently used datasets are dropped and re-opened on
+# their next access.
+MEMORY_BUDGET = int(os.environ.get('DATA_MEMORY_BUDGET', 512 * 1024 * 1024))
+
+
+def block_column(name):
+	return BLOCK_COLUMNS.get(name, 'block')
+
+
+def pickle_path(name):
+	return os.path.join(DATA_DIR, '%s.pkl' % name)
+
+
+def arrow_path(name):
+	return os.path.join(DATA_DIR, '%s.arrow' % name)
+
+
+def datasets():
+	"""Names of all datasets available in DATA_DIR, in either format."""
+	paths = glob.glob(os.path.join(DATA_DIR, '*.pkl')) + \
+		glob.glob(os.path.join(DATA_DIR, '*.arrow'))
+	return sorted({os.path.splitext(os.path.basename(p))[0] for p in paths})
+
+
+def _carbon_columns(df):
+	# Carbon densities are per hectare, over 300m (9 ha) pixels.
+	return {'tC': df['carbon'] * 9 * df['frequency']}
+
+
+def _date_columns(df):
+	dates = pd.DatetimeIndex(df['date'])
+	return {
+		'year': np.asarray(dates.year, dtype=np.int16),
+		'day_of_year': np.asarray(dates.dayofyear, dtype=np.int16),
+	}
+
+
+# Columns derived from each dataset at ingest, so that the block views only
+# ever read.
+DERIVED = {
+	'carbon': _carbon_columns,
+	'forestcarbon': _carbon_columns,
+	'fires': _date_columns,
+	'weather': _date_columns,
+	'evapotranspiration': _date_columns,
+	'vi': _date_columns,
+}
+
+
+def derive(name, df):
+	"""Rename the source columns of a dataset and add its derived columns."""
+
+	# Stored datasets are already renamed, and are not copied to rename them.
+	renames = {k: v for k, v in RENAMES.get(name, {}).items() if k in df}
+	if renames:
+		df = df.rename(columns=renames)
+
+	if name in DERIVED:
+		derived = {
+			column: values for column, values in DERIVED[name](df).items()
+			if column not in df
+		}
+		if derived:
+			df = df.assign(**derived)
+
+	return df
+
+
+def prepare(name, df, validate=False):
+	"""A dataset with its derived columns, cast to the compact types of
+	schema.py.
+
+	With `validate`, raise ValueError if a value would not survive the cast,
+	which otherwise wraps around silently.
+	"""
+
+	df = derive(name, df)
+	if validate:
+		schema.validate(name, df)
+	return schema.apply(name, df)
+
+
+def _group_by_block(df, column):
+	# Stable sort on first-appearance order, so that the ordering of the
+	# blocks (and of the rows within a block) is the one in the source data.
+	# Frames that are already grouped, as every stored one is, are not copied.
+	order = pd.Categorical(df[column], categories=pd.unique(df[column]))
+	if (np.diff(order.codes) >= 0).all() and df.index.equals(pd.RangeIndex(len(df))):
+		return df
+	df = df.iloc[order.argsort(kind='mergesort')]
+	return df.reset_index(drop=True)
+
+
+def write(name, df):
+	"""Write a DataFrame to data/<name>.arrow, grouped by block.
+
+	`df` is validated before it is cast, so it should not have been prepared.
+	"""
+
+	schema.validate(name, df)
+	df = schema.apply(name, df)
+
+	column = block_column(name)
+	df = _group_by_block(df, column)
+
+	# A single batch, so that each column reads back as one contiguous
+	# array that pandas can wrap without copying.
+	table = pa.Table.from_pandas(df, preserve_index=False).combine_chunks()
+
+	tmp = arrow_path(name) + '.tmp'
+	with pa.OSFile(tmp, 'wb') as sink:
+		with pa.ipc.new_file(sink, table.schema) as writer:
+			writer.write_table(table)
+	os.replace(tmp, arrow_path(name))
+
+	return arrow_path(name)
+
+
+def convert(name):
+	"""Migrate data/<name>.pkl to a block-partitioned data/<name>.arrow."""
+	return write(name, derive(name, pd.read_pickle(pickle_path(name))))
+
+
+def open_table(name):
+	"""Open data/<name>.arrow as a memory-mapped Arrow table."""
+	source = pa.memory_map(arrow_path(name), 'r')
+	return pa.ipc.open_file(source).read_all()
+
+
+def version(name):
+	"""Stamp that changes whenever the stored copy of a dataset changes."""
+
+	if timeseries.exists(name):
+		return timeseries.version(name)
+	if os.path.exists(arrow_path(name)):
+		return os.stat(arrow_path(name)).st_mtime_ns
+	return os.stat(pickle_path(name)).st_mtime_ns
+
+
+# File digests, keyed by path and stat, so a rerun only stats the files.
+_digests = {}
+
+
+def file_digest(path):
+	"""sha256 of a file's content, recomputed only when its stat changes."""
+
+	stat = os.stat(path)
+	stamp = (path, stat.st_mtime_ns, stat.st_size)
+	if stamp not in _digests:
+		digest = hashlib.sha256()
+		with open(path, 'rb') as f:
+			for chunk in iter(lambda: f.read(1 << 20), b''):
+				digest.update(chunk)
+		_digests[stamp] = digest.hexdigest()
+	return _digests[stamp]
+
+
+def dataset_digest(name):
+	"""sha256 of the stored copy of a dataset, or '' if there is none."""
+
+	if timeseries.exists(name):
+		# Segments are immutable and named in the manifest.
+		path = timeseries.manifest_path(name)
+	elif os.path.exists(arrow_path(name)):
+		path = arrow_path(name)
+	else:
+		path = pickle_path(name)
+	return file_digest(path) if os.path.exists(path) else ''
+
+
+def read(name):
+	"""Read a dataset as a DataFrame, preferring the memory-mapped copy.
+
+	A daily series kept in the partitioned store (see timeseries.py) is read
+	from there.
+	"""
+
+	if timeseries.exists(name):
+		df = timeseries.read(name)
+	elif not os.path.exists(arrow_path(name)):
+		df = pd.read_pickle(pickle_path(name))
+	else:
+		# From a single batch, split_blocks leaves the numeric columns as
+		# views on the memory map instead of consolidating them into copies.
+		df = open_table(name).to_pandas(split_blocks=True)
+
+	return prepare(name, df)
+
+
+def _extend(df, rows):
+	# `rows` appended to `df`, with each categorical column on the union of
+	# the categories of both, so that it stays categorical.
+	categories = {}
+	for column in df.columns:
+		if isinstance(df[column].dtype, pd.CategoricalDtype):
+			old, new = df[column].cat.categories, rows[column].cat.categories
+			union = old.append(new.difference(old, sort=False))
+			categories[column] = union.sort_values() if df[column].cat.ordered else union
+
+	return pd.concat([
+		frame.assign(**{c: frame[c].cat.set_categories(u) for c, u in categories.items()})
+		for frame in (df, rows)
+	], ignore_index=True)
+
+
+class BlockIndex(object):
+	"""Row ranges of each block in a frame that is grouped by block.
+
+	The block column is stored as a categorical, and each block maps to a
+	contiguous [start, stop) range, so selecting a block is a slice rather
+	than a boolean scan over the whole table.
+	"""
+
+	def __init__(self, df, column):
+
+		df = _group_by_block(df, column)
+		blocks = pd.Categorical(df[column], categories=pd.unique(df[column]))
+		df[column] = blocks
+
+		codes = blocks.codes
+		bounds = np.flatnonzero(np.diff(codes)) + 1
+		starts = np.concatenate([[0], bounds])
+		stops = np.concatenate([bounds, [len(codes)]])
+
+		self.frame = df
+		self.column = column
+		self.offsets = {
+			blocks.categories[codes[start]]: (start, stop)
+			for start, stop in zip(starts, stops) if stop > start
+		}
+
+	def blocks(self):
+		return list(self.offsets)
+
+	def get(self, block):
+		start, stop = self.offsets.get(block, (0, 0))
+		return self.frame.iloc[start:stop]
+
+
+class Registry(object):
+	"""Datasets opened on first access and kept in least recently used order.
+
+	Each dataset is read and indexed by block the first time it is requested,
+	so a section that only needs the summary never touches the daily series.
+	The registry is shared by every session of the process: a dataset is held
+	once, and is treated as read-only by its users.  When the stored copy of a
+	dataset changes, it is re-read on its next access and the results derived
+	from it in cache are dropped.  A daily series that has only been appended
+	to is not re-read: the segments added to it are read and appended to the
+	frame held.
+	"""
+
+	def __init__(self, budget=MEMORY_BUDGET):
+		self.budget = budget
+		self.nbytes = 0
+		self._tables = collections.OrderedDict()
+		self._sizes = {}
+		self._versions = {}
+		# Segments each series held was read from.
+		self._segments = {}
+		self._lock = threading.RLock()
+
+	def __contains__(self, name):
+		return name in self._tables
+
+	def get(self, name):
+
+		stamp = version(name)
+
+		with self._lock:
+			if name in self._tables and self._versions[name] == stamp:
+				self._tables.move_to_end(name)
+				return self._tables[name]
+
+			df = self._read(name)
+			if name in self._tables:
+				self.discard(name)
+				cache.clear(name)
+
+			index = BlockIndex(df, block_column(name))
+			self._tables[name] = index
+			self._versions[name] = stamp
+			self._sizes[name] = int(index.frame.memory_usage(deep=True).sum())
+			self.nbytes += self._sizes[name]
+			self._evict()
+
+			return index
+
+	def _read(self, name):
+
+		if not timeseries.exists(name):
+			return read(name)
+
+		for attempt in range(2):
+			segments = timeseries.listed(name)
+			previous = self._segments.get(name) if name in self._tables else None
+			try:
+				if previous is not None and set(previous) <= set(segments):
+					known = set(previous)
+					new = [s for s in segments if s not in known]
+					df = self._tables[name].frame
+					if new:
+						df = _extend(df, prepare(name, timeseries.read(name, new)))
+				else:
+					df = prepare(name, timeseries.read(name, segments))
+				break
+			except FileNotFoundError:
+				# A compaction replaced the segments after they were listed.
+				if attempt:
+					raise
+
+		self._segments[name] = segments
+		return df
+
+	def discard(self, name):
+		with self._lock:
+			if name in self._tables:
+				del self._tables[name]
+				del self._versions[name]
+				self.nbytes -= self._sizes.pop(name)
+
+	def clear(self):
+		with self._lock:
+			for name in list(self._tables):
+				self.discard(name)
+
+	def _evict(self):
+		# The most recently used dataset is kept even if it alone is over
+		# the budget.
+		while self.nbytes > self.budget and len(self._tables) > 1:
+			self.discard(next(iter(self._tables)))
+
+
+registry = Registry()
+
+
+def load(name):
+	"""A dataset indexed by block, read on first access in this process."""
+	return registry.get(name).frame
+
+
+def get_block(name, block):
+	"""Rows of a dataset for a single block, as a slice of the loaded frame."""
+	return registry.get(name).get(block)
+
+
+if __name__ == '__main__':
+
+	names = sys.argv[1:] or [
+		os.path.splitext(os.path.basename(p))[0]
+		for p in sorted(glob.glob(os.path.join(DATA_DIR, '*.pkl')))
+	]
+
+	for name in names:
+		print('%s -> %s' % (pickle_path(name), convert(name)))
@@ -0,0 +1,274 @@
+"""Append-only, partitioned storage for the daily time series.
+
+fires, weather, evapotranspiration and vi grow by a day at a time.  Rather
+than rewriting a whole pickle, each series can be kept under
+data/series/<name>/ as Arrow segments partitioned by block and year:
+
+	data/series/<name>/manifest.json
+	data/series/<name>/<block>/<year>/<segment>.arrow
+
+append() writes only the new days, as one small segment per (block, year)
+touched, and records them in the manifest, which is replaced atomically.
+compact() merges the segments of each partition into one; the app runs it
+in a background thread with start_compaction().  The app notices a new
+manifest through its modification time and reads only the segments added to
+it without a restart (see store.Registry).
+
+	python timeseries.py init fires
+	python timeseries.py append fires new_days.pkl [--compact]
+	python timeseries.py compact fires
+"""
+
+import collections
+import contextlib
+import fcntl
+import json
+import os
+import threading
+import time
+
+import pandas as pd
+import pyarrow as pa
+
+import schema
+
+
+SERIES_DIR = os.path.join('data', 'series')
+
+# Datasets that may be kept here.
+SERIES = ['fires', 'weather', 'evapotranspiration', 'vi']
+
+# Seconds between background compactions.
+COMPACTION_INTERVAL = 10 * 60
+
+# The compaction thread of this process, once started.
+_compaction = None
+
+
+def series_dir(name):
+	return os.path.join(SERIES_DIR, name)
+
+
+def manifest_path(name):
+	return os.path.join(series_dir(name), 'manifest.json')
+
+
+def exists(name):
+	return os.path.exists(manifest_path(name))
+
+
+def version(name):
+	"""Changes whenever the series is appended to or compacted."""
+	return os.stat(manifest_path(name)).st_mtime_ns
+
+
+@contextlib.contextmanager
+def _locked(name):
+	# Serializes writers (appends and compactions) across processes.
+	os.makedirs(series_dir(name), exist_ok=True)
+	with open(os.path.join(series_dir(name), '.lock'), 'w') as lock:
+		fcntl.flock(lock, fcntl.LOCK_EX)
+		try:
+			yield
+		finally:
+			fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def _read_manifest(name):
+	if not exists(name):
+		return {'segments': collections.OrderedDict(), 'last': {}}
+	with open(manifest_path(name)) as f:
+		return json.load(f, object_pairs_hook=collections.OrderedDict)
+
+
+def _write_manifest(name, manifest):
+	tmp = manifest_path(name) + '.tmp'
+	with open(tmp, 'w') as f:
+		json.dump(manifest, f, indent=1)
+	os.replace(tmp, manifest_path(name))
+
+
+def _write_segment(name, partition, df):
+
+	directory = os.path.join(series_dir(name), partition)
+	os.makedirs(directory, exist_ok=True)
+
+	segment = os.path.join(partition, '%d.arrow' % time.time_ns())
+	path = os.path.join(series_dir(name), segment)
+
+	table = pa.Table.from_pandas(df, preserve_index=False)
+	with pa.OSFile(path + '.tmp', 'wb') as sink:
+		with pa.ipc.new_file(sink, table.schema) as writer:
+			writer.write_table(table)
+	os.replace(path + '.tmp', path)
+
+	return segment
+
+
+def _open_segment(name, segment):
+	source = pa.memory_map(os.path.join(series_dir(name), segment), 'r')
+	return pa.ipc.open_file(source).read_all()
+
+
+def append(name, df, block_column='block'):
+	"""Append the rows of `df` that are newer than the stored ones.
+
+	Rows are expected to carry `date` (YYYY-MM-DD) and `year` columns, and
+	are validated against the dataset's schema.  For each block, rows on or
+	before its last stored date are ignored, so re-running a refresh is
+	harmless.  Returns the number of rows written.
+	"""
+
+	schema.validate(name, df)
+	df = schema.apply(name, df)
+
+	# Segments hold plain strings; the compact types are applied on read.
+	df = df.assign(**{
+		block_column: df[block_column].astype(str),
+		'date': df['date'].astype(str),
+	})
+
+	with _locked(name):
+		manifest = _read_manifest(name)
+		written = 0
+
+		for block, rows in df.groupby(block_column, sort=False, observed=True):
+			last = manifest['last'].get(str(block))
+			if last is not None:
+				rows = rows[rows['date'] > last]
+			if not len(rows):
+				continue
+
+			rows = rows.sort_values('date', kind='mergesort')
+			for year, part in rows.groupby('year', sort=True):
+				partition = '%s/%d' % (block, year)
+				segment = _write_segment(name, partition, part)
+				manifest['segments'].setdefault(partition, []).append(segment)
+
+			manifest['last'][str(block)] = rows['date'].iloc[-1]
+			written += len(rows)
+
+		if written or not exists(name):
+			_write_manifest(name, manifest)
+
+	return written
+
+
+def listed(name):
+	"""The segments of a series in its manifest, in the order read() reads them."""
+	manifest = _read_manifest(name)
+	return [segment for segments in manifest['segments'].values() for segment in segments]
+
+
+def read(name, segments=None):
+	"""The whole series, ordered by block and date, or only some `segments`.
+
+	Reading given segments raises FileNotFoundError if a compaction has
+	replaced any of them since they were listed.
+	"""
+
+	if segments is not None:
+		return _read_segments(name, segments)
+
+	for attempt in range(2):
+		try:
+			return _read_segments(name, listed(name))
+		except FileNotFoundError:
+			# A compaction replaced the segments after the manifest was read.
+			if attempt:
+				raise
+
+
+def _read_segments(name, segments):
+
+	tables = [_open_segment(name, segment) for segment in segments]
+	if not tables:
+		return pd.DataFrame()
+
+	schema = tables[0].schema
+	table = pa.concat_tables([t.cast(schema) for t in tables])
+	return table.to_pandas(split_blocks=True)
+
+
+def compact(name, max_segments=1):
+	"""Merge every partition holding more than `max_segments` segments.
+
+	Returns the number of partitions compacted.
+	"""
+
+	with _locked(name):
+		manifest = _read_manifest(name)
+		replaced = []
+		compacted = 0
+
+		for partition, segments in manifest['segments'].items():
+			if len(segments) <= max_segments:
+				continue
+			table = pa.concat_tables([_open_segment(name, s) for s in segments])
+			merged = _write_segment(name, partition, table.to_pandas())
+			manifest['segments'][partition] = [merged]
+			replaced.extend(segments)
+			compacted += 1
+
+		if compacted:
+			_write_manifest(name, manifest)
+
+	# Segments are unlinked only once the new manifest is in place; readers
+	# holding a memory map of them are unaffected.
+	for segment in replaced:
+		os.remove(os.path.join(series_dir(name), segment))
+
+	return compacted
+
+
+def start_compaction(names, interval=COMPACTION_INTERVAL):
+	"""Compact the given series every `interval` seconds in a daemon thread.
+
+	The thread is started once per process; later calls return it.
+	"""
+
+	global _compaction
+	if _compaction is not None and _compaction.is_alive():
+		return _compaction
+
+	def run():
+		while True:
+			time.sleep(interval)
+			for name in names:
+				if exists(name):
+					compact(name)
+
+	_compaction = threading.Thread(target=run, name='timeseries-compaction', daemon=True)
+	_compaction.start()
+	return _compaction
+
+
+if __name__ == '__main__':
+
+	import argparse
+
+	import store
+
+	parser = argparse.ArgumentParser(description='Maintain the partitioned daily series.')
+	parser.add_argument('command', choices=['init', 'append', 'compact'])
+	parser.add_argument('name', help='dataset name, e.g. fires')
+	parser.add_argument('path', nargs='?',
+		help='pickle or CSV of new rows, for append')
+	parser.add_argument('--compact', action='store_true',
+		help='compact after appending')
+	args = parser.parse_args()
+
+	if args.command == 'init':
+		df = store.derive(args.name, pd.read_pickle(store.pickle_path(args.name)))
+		print('%s: %d rows' % (args.name, append(args.name, df)))
+
+	elif args.command == 'append':
+		if args.path.endswith('.csv'):
+			df = pd.read_csv(args.path, dtype={'date': str})
+		else:
+			df = pd.read_pickle(args.path)
+		df = store.derive(args.name, df)
+		print('%s: %d new rows' % (args.name, append(args.name, df)))
+
+	if args.command == 'compact' or args.compact:
+		print('%s: %d partitions compacted' % (args.name, compact(args.name)))
@@ -0,0 +1,275 @@
+"""Trend and stationarity tests of every block's daily series.
+
+Each (block, variable) series is reduced to monthly means, and tested for
+  - a monotonic trend, by the seasonal Mann-Kendall test (the Mann-Kendall
+    statistic of each calendar month across years, summed), which is not
+    fooled by the seasonal cycle;
+  - the size of that trend, by the seasonal Sen's slope (the median of the
+    year-on-year slopes within each calendar month), in units per year;
+  - stationarity, by the augmented Dickey-Fuller test of the monthly
+    anomalies from the seasonal cycle.
+
+Monthly means are computed for all blocks in one grouped pass, and the tests
+of each series are fanned out over a process pool.  The results are stored
+as data/trends/<version>.arrow, where the version is hashed from the content
+of the series and of this module, so they are recomputed only when either
+changes:
+
+	python trends.py [--jobs N]
+
+When no stored results match the data, the app tests the series of the
+block being viewed on the fly.  The Docker image and Heroku builds (see
+bin/post_compile) run this module at build time rather than on every boot.
+"""
+
+import concurrent.futures
+import hashlib
+import os
+import warnings
+
+import numpy as np
+import pandas as pd
+
+import cache
+import store
+
+
+# Series tested, by dataset.
+VARIABLES = {
+	'fires': ['fires'],
+	'vi': ['NDVI', 'EVI'],
+	'evapotranspiration': ['evapotranspiration'],
+	'weather': ['temp_celsius', 'precip_cm'],
+}
+
+TRENDS_DIR = os.path.join(store.DATA_DIR, 'trends')
+
+# Significance level of the tests.
+ALPHA = 0.05
+
+# Series with fewer monthly means are not tested.
+MIN_MONTHS = 36
+
+# Series per task sent to a worker.
+CHUNK_SIZE = 200
+
+
+def version():
+	"""Content hash of the tested series and of this module."""
+
+	digest = hashlib.sha256()
+	for name in VARIABLES:
+		digest.update(store.dataset_digest(name).encode())
+	digest.update(store.file_digest(os.path.abspath(__file__)).encode())
+	return digest.hexdigest()
+
+
+def trends_path(key):
+	return os.path.join(TRENDS_DIR, '%s.arrow' % key)
+
+
+def monthly(df, variables):
+	"""Monthly means of `variables` by block, as one long frame.
+
+	Columns are block, variable, year, month and value.
+	"""
+
+	# Dates are stored as YYYY-MM-DD strings, so the month is read from the
+	# (few) distinct dates rather than parsed on every row.
+	dates = pd.Categorical(df['date'])
+	months = np.array([int(d[5:7]) for d in dates.categories.astype(str)], dtype=np.int8)
+
+	frame = pd.DataFrame({
+		'block': np.asarray(df['block'], dtype=object),
+		'year': df['year'].to_numpy(),
+		'month': months[dates.codes],
+	})
+	frames = []
+	for v in variables:
+		means = frame.assign(value=df[v].to_numpy(dtype=float)).groupby(
+			['block', 'year', 'month'], sort=True
+		)['value'].mean().dropna()
+		frames.append(means.reset_index().assign(variable=v))
+
+	return pd.concat(frames, ignore_index=True)[['block', 'variable', 'year', 'month', 'value']]
+
+
+def seasonal_mann_kendall(year, month, value):
+	"""Seasonal Mann-Kendall statistic S, its z score and two-sided p-value."""
+
+	from scipy import stats
+
+	s = 0.0
+	var = 0.0
+	for m in np.unique(month):
+		x = value[month == m][np.argsort(year[month == m])]
+		n = len(x)
+		if n < 2:
+			continue
+		s += np.sign(x[np.newaxis, :] - x[:, np.newaxis])[np.triu_indices(n, 1)].sum()
+		_, ties = np.unique(x, return_counts=True)
+		var += (n * (n - 1) * (2 * n + 5) - (ties * (ties - 1) * (2 * ties + 5)).sum()) / 18
+
+	if var == 0:
+		return s, 0.0, 1.0
+	z = (s - np.sign(s)) / np.sqrt(var)
+	return s, z, 2 * stats.norm.sf(abs(z))
+
+
+def seasonal_sen_slope(year, month, value):
+	"""Median of the pairwise slopes within each calendar month, per year."""
+
+	slopes = []
+	for m in np.unique(month):
+		y, x = year[month == m], value[month == m]
+		i, j = np.triu_indices(len(x), 1)
+		slopes.append((x[j] - x[i]) / (y[j] - y[i]))
+	slopes = np.concatenate(slopes) if slopes else np.array([])
+	slopes = slopes[np.isfinite(slopes)]
+	return np.median(slopes) if len(slopes) else np.nan
+
+
+def adf(year, month, value):
+	"""Augmented Dickey-Fuller statistic and p-value of the monthly anomalies."""
+
+	from statsmodels.tsa.stattools import adfuller
+
+	order = np.lexsort((month, year))
+	year, month, value = year[order], month[order], value[order]
+
+	# Anomalies from the mean of each calendar month.
+	seasonal = pd.Series(value).groupby(month).transform('mean').to_numpy()
+	anomaly = value - seasonal
+	if np.ptp(anomaly) == 0:
+		return np.nan, np.nan
+
+	with warnings.catch_warnings():
+		# Newer statsmodels warn that the tuple result is going away.
+		warnings.simplefilter('ignore', FutureWarning)
+		statistic, p = adfuller(anomaly, autolag='AIC')[:2]
+	return statistic, p
+
+
+def test(year, month, value):
+	"""Test results of one monthly series, as a dict."""
+
+	year = np.asarray(year, dtype=float)
+	month = np.asarray(month)
+	value = np.asarray(value, dtype=float)
+
+	row = {'months': len(value), 'start': int(year.min()), 'end': int(year.max())}
+	if len(value) < MIN_MONTHS:
+		return dict(row, mk_z=np.nan, mk_p=np.nan, sen_slope=np.nan, adf_stat=np.nan, adf_p=np.nan)
+
+	_, z, p = seasonal_mann_kendall(year, month, value)
+	adf_stat, adf_p = adf(year, month, value)
+	return dict(
+		row, mk_z=z, mk_p=p, sen_slope=seasonal_sen_slope(year, month, value),
+		adf_stat=adf_stat, adf_p=adf_p,
+	)
+
+
+def _test_chunk(series):
+	# Runs in a worker: tests a list of (block, variable, year, month, value).
+	return [
+		dict(test(year, month, value), block=block, variable=variable)
+		for block, variable, year, month, value in series
+	]
+
+
+def _series(means):
+	grouped = means.groupby(['block', 'variable'], sort=False)
+	for (block, variable), df in grouped:
+		yield block, variable, df['year'].to_numpy(), df['month'].to_numpy(), df['value'].to_numpy()
+
+
+def _frame(rows):
+
+	df = pd.DataFrame(rows, columns=[
+		'block', 'variable', 'months', 'start', 'end',
+		'mk_z', 'mk_p', 'sen_slope', 'adf_stat', 'adf_p',
+	])
+	df['trend'] = np.where(
+		df['mk_p'] < ALPHA, np.where(df['mk_z'] > 0, 'increasing', 'decreasing'), 'none'
+	)
+	df['stationary'] = df['adf_p'] < ALPHA
+	return df
+
+
+def build(jobs=None, blocks=None):
+	"""Test every series of `blocks` (default: all), over `jobs` processes."""
+
+	means = []
+	for name, variables in VARIABLES.items():
+		df = store.load(name)
+		if blocks is not None:
+			df = df[np.isin(np.asarray(df['block'], dtype=object), blocks)]
+		means.append(monthly(df, variables))
+	series = list(_series(pd.concat(means, ignore_index=True)))
+
+	chunks = [series[i:i + CHUNK_SIZE] for i in range(0, len(series), CHUNK_SIZE)]
+	if jobs == 1 or len(chunks) <= 1:
+		results = [_test_chunk(chunk) for chunk in chunks]
+	else:
+		with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as pool:
+			results = list(pool.map(_test_chunk, chunks))
+	rows = [row for chunk in results for row in chunk]
+
+	order = {v: i for i, v in enumerate(v for vs in VARIABLES.values() for v in vs)}
+	df = _frame(rows)
+	return df.sort_values(
+		['block', 'variable'], key=lambda c: c.map(order) if c.name == 'variable' else c,
+		kind='stable',
+	).reset_index(drop=True)
+
+
+def save(df, key=None):
+
+	path = trends_path(key or version())
+	os.makedirs(TRENDS_DIR, exist_ok=True)
+	tmp = '%s.%d.tmp' % (path, os.getpid())
+	df.to_feather(tmp)
+	os.replace(tmp, path)
+	return path
+
+
+@cache.memoize(maxsize=4, datasets=[])
+def _read(key):
+	return pd.read_feather(trends_path(key))
+
+
+def load(key=None):
+	"""The stored results for the current data, or None."""
+	key = key or version()
+	if not os.path.exists(trends_path(key)):
+		return None
+	return _read(key)
+
+
+@cache.memoize(maxsize=64, datasets=[])
+def _block(key, block):
+	return build(jobs=1, blocks=[block])
+
+
+def block_trends(block):
+	"""Test results of every series of one block, stored or computed."""
+
+	key = version()
+	df = load(key)
+	if df is not None:
+		return df[df['block'] == block]
+	return _block(key, block)
+
+
+if __name__ == '__main__':
+
+	import argparse
+	import time
+
+	parser = argparse.ArgumentParser(description='Test every block series for trends.')
+	parser.add_argument('--jobs', type=int, help='number of worker processes')
+	args = parser.parse_args()
+
+	start = time.perf_counter()
+	df = build(args.jobs)
+	print('%s: %d series in %.1fs' % (save(df), len(df), time.perf_counter() - start))
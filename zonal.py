@@ -0,0 +1,184 @@
+"""Zonal statistics of rasters over the hunting blocks.
+
+Produces the per-block pixel-value histograms stored in carbon.pkl,
+forestcarbon.pkl and soil.pkl.  For each block only the raster window that
+intersects its boundary is read, so whole 10x10 degree tiles are never loaded
+into memory.  The polygon mask of a block is rasterized once per grid and
+reused for every raster on that grid (e.g. the six soil depths), and blocks
+are processed in parallel.
+
+	python zonal.py carbon data/10S_030E.tif --value carbon --bins 150
+	python zonal.py soil soil_*.tif --value carbon_g_per_kg --label depth
+
+rasterio is only required to run this module, not the app.
+"""
+
+import argparse
+import concurrent.futures
+import math
+import os
+
+import numpy as np
+import pandas as pd
+
+import boundaries
+import store
+
+
+# Block masks, keyed by (block, grid), for the life of the process.
+_masks = {}
+
+
+def _to_crs(geometry, crs):
+	# Boundaries are in geographic coordinates.
+	from rasterio.warp import transform_geom
+	if crs is None or crs.to_epsg() == 4326:
+		return geometry
+	return transform_geom('EPSG:4326', crs, geometry)
+
+
+def _window(src, geometry):
+	"""Pixel window covering the bounds of a geometry, or None if outside."""
+
+	from rasterio.windows import Window, from_bounds
+
+	west, south, east, north = boundaries.bounds(geometry)
+	window = from_bounds(west, south, east, north, transform=src.transform)
+
+	col_start = max(int(math.floor(window.col_off)), 0)
+	row_start = max(int(math.floor(window.row_off)), 0)
+	col_stop = min(int(math.ceil(window.col_off + window.width)), src.width)
+	row_stop = min(int(math.ceil(window.row_off + window.height)), src.height)
+
+	if col_stop <= col_start or row_stop <= row_start:
+		return None
+	return Window(col_start, row_start, col_stop - col_start, row_stop - row_start)
+
+
+def block_mask(block, geometry, transform, shape):
+	"""Pixels of a window whose centers fall inside the block."""
+
+	key = (block, tuple(transform)[:6], shape)
+	if key not in _masks:
+		from rasterio.features import geometry_mask
+		_masks[key] = geometry_mask(
+			[geometry], out_shape=shape, transform=transform, invert=True
+		)
+	return _masks[key]
+
+
+def block_values(path, block, geometry, band=1):
+	"""Valid pixel values of a raster within a block."""
+
+	import rasterio
+
+	with rasterio.open(path) as src:
+		geometry = _to_crs(geometry, src.crs)
+		window = _window(src, geometry)
+		if window is None:
+			return np.array([], dtype=src.dtypes[band - 1])
+		data = src.read(band, window=window, masked=True)
+		transform = src.window_transform(window)
+
+	inside = block_mask(block, geometry, transform, data.shape)
+	return data.data[inside & ~np.ma.getmaskarray(data)]
+
+
+def histogram(values, bins=None, value_range=None):
+	"""Frequency of each value, or of each bin (by its center) if `bins`."""
+
+	if bins is None:
+		value, frequency = np.unique(values, return_counts=True)
+	else:
+		frequency, edges = np.histogram(values, bins=bins, range=value_range)
+		value = (edges[:-1] + edges[1:]) / 2
+
+	return frequency, value
+
+
+def _block_stats(task):
+	# Runs in a worker: every raster for one block, so the mask is reused
+	# across rasters that share a grid.
+	block, geometry, rasters, value_name, label, bins, value_range = task
+
+	histograms, totals = [], []
+	for path, label_value in rasters:
+		values = block_values(path, block, geometry)
+		frequency, value = histogram(values, bins, value_range)
+
+		df = pd.DataFrame({'frequency': frequency, value_name: value})
+		total = {'block': block, 'count': len(values), 'sum': float(values.sum())}
+		if label:
+			df[label] = label_value
+			total[label] = label_value
+		df['block'] = block
+
+		histograms.append(df)
+		totals.append(total)
+
+	return histograms, totals
+
+
+def zonal_stats(rasters, value_name='value', label=None, bins=None,
+		value_range=None, blocks=None, jobs=None):
+	"""Histograms and totals of one or more rasters for every block.
+
+	`rasters` is a list of paths, or of (path, label value) pairs, in which
+	case the label value is reported in a `label` column.  Returns a frame of
+	frequency, value_name, [label,] block and a frame of block, count, sum.
+	"""
+
+	rasters = [r if isinstance(r, tuple) else (r, None) for r in rasters]
+	blocks = blocks or boundaries.load()
+
+	tasks = [
+		(block, geometry, rasters, value_name, label, bins, value_range)
+		for block, geometry in blocks.items() if geometry is not None
+	]
+
+	histograms, totals = [], []
+	with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as pool:
+		for h, t in pool.map(_block_stats, tasks):
+			histograms.extend(h)
+			totals.extend(t)
+
+	return (
+		pd.concat(histograms, ignore_index=True),
+		pd.DataFrame(totals)
+	)
+
+
+if __name__ == '__main__':
+
+	parser = argparse.ArgumentParser(
+		description='Per-block histograms of rasters, written to data/<name>.pkl.'
+	)
+	parser.add_argument('name', help='dataset name, e.g. carbon')
+	parser.add_argument('rasters', nargs='+')
+	parser.add_argument('--value', default='value',
+		help='name of the value column')
+	parser.add_argument('--label',
+		help='column holding each raster\'s file name, e.g. depth')
+	parser.add_argument('--bins', type=int,
+		help='number of histogram bins (default: one per distinct value)')
+	parser.add_argument('--range', type=float, nargs=2, dest='value_range',
+		help='lower and upper bound of the bins')
+	parser.add_argument('--jobs', type=int,
+		help='number of worker processes')
+	args = parser.parse_args()
+
+	rasters = args.rasters
+	if args.label:
+		rasters = [
+			(path, os.path.splitext(os.path.basename(path))[0].split('_')[-1])
+			for path in rasters
+		]
+
+	df, _ = zonal_stats(
+		rasters, args.value, args.label, args.bins, args.value_range, jobs=args.jobs
+	)
+
+	tmp = store.pickle_path(args.name) + '.tmp'
+	df.to_pickle(tmp)
+	os.replace(tmp, store.pickle_path(args.name))
+	print('%s -> %s' % (store.pickle_path(args.name), store.convert(args.name)))